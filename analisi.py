@@ -0,0 +1,1326 @@
+"""Motore di analisi degli indici: caricamento dei CSV e calcolo delle performance
+
+Il modulo non dipende da Streamlit, così può essere usato sia dall'app (main.py)
+sia dall'elaborazione batch da riga di comando (batch.py).
+"""
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import time
+
+# Versione del parser: va incrementata quando cambia l'output di carica_csv,
+# così le voci già in cache non vengono riutilizzate
+VERSIONE_PARSER = 3
+CACHE_PARSING_MAX_BYTES = 256 * 1024 * 1024
+
+class CacheParsing:
+    """Cache LRU dei file già analizzati, indicizzata sull'hash del contenuto"""
+
+    def __init__(self, max_bytes=CACHE_PARSING_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.voci = OrderedDict()
+        self.bytes_usati = 0
+
+    @staticmethod
+    def chiave(contenuto):
+        """Calcola la chiave di cache dai byte del file e dalla versione del parser"""
+        digest = hashlib.blake2b(contenuto, digest_size=16).hexdigest()
+        return f"{digest}-v{VERSIONE_PARSER}"
+
+    def get(self, chiave):
+        """Restituisce il risultato in cache (o None) e lo marca come usato di recente"""
+        if chiave not in self.voci:
+            return None
+        self.voci.move_to_end(chiave)
+        return self.voci[chiave][0]
+
+    def put(self, chiave, risultato):
+        """Inserisce un risultato ed elimina le voci meno recenti oltre il limite di memoria"""
+        df, _ = risultato
+        dimensione = int(df.memory_usage(deep=True).sum()) if df is not None else 0
+        if dimensione > self.max_bytes:
+            return
+        if chiave in self.voci:
+            self.bytes_usati -= self.voci.pop(chiave)[1]
+        self.voci[chiave] = (risultato, dimensione)
+        self.bytes_usati += dimensione
+        while self.bytes_usati > self.max_bytes:
+            _, (_, dimensione_rimossa) = self.voci.popitem(last=False)
+            self.bytes_usati -= dimensione_rimossa
+
+CARTELLA_ARCHIVIO = os.environ.get('ARCHIVIO_INDICI', 'archivio_indici')
+
+def archivio_disponibile():
+    """Indica se pyarrow è installato, senza importarlo"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+def modulo_feather():
+    """Importa pyarrow.feather solo al primo accesso all'archivio"""
+    import pyarrow.feather as feather
+    return feather
+
+class ArchivioLocale:
+    """Archivio su disco delle serie caricate: un file Arrow IPC per indice e un manifest JSON"""
+
+    def __init__(self, cartella=CARTELLA_ARCHIVIO):
+        self.cartella = cartella
+        self.percorso_manifest = os.path.join(cartella, 'manifest.json')
+        self.manifest = self.leggi_manifest()
+
+    def leggi_manifest(self):
+        """Legge il manifest, ignorandolo se scritto da una versione diversa del parser"""
+        try:
+            with open(self.percorso_manifest, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('versione_parser') != VERSIONE_PARSER:
+            return {}
+        return manifest.get('indici', {})
+
+    def scrivi_manifest(self):
+        """Scrive il manifest in modo atomico"""
+        os.makedirs(self.cartella, exist_ok=True)
+        temporaneo = self.percorso_manifest + '.tmp'
+        with open(temporaneo, 'w', encoding='utf-8') as f:
+            json.dump({'versione_parser': VERSIONE_PARSER, 'indici': self.manifest}, f, indent=2)
+        os.replace(temporaneo, self.percorso_manifest)
+
+    def leggi(self, nome):
+        """Legge un indice dall'archivio mappando il file in memoria"""
+        voce = self.manifest[nome]
+        tabella = modulo_feather().read_table(os.path.join(self.cartella, voce['file']), memory_map=True)
+        return tabella.to_pandas()
+
+    def cerca(self, chiave):
+        """Restituisce la serie archiviata con lo stesso contenuto (o None)"""
+        for nome, voce in self.manifest.items():
+            if voce['chiave'] == chiave:
+                try:
+                    return self.leggi(nome)
+                except OSError:
+                    return None
+        return None
+
+    def salva(self, nome, df, chiave):
+        """Salva una serie appena analizzata, se non è già in archivio con lo stesso contenuto"""
+        if self.manifest.get(nome, {}).get('chiave') == chiave:
+            return
+        os.makedirs(self.cartella, exist_ok=True)
+        nome_file = hashlib.blake2b(nome.encode('utf-8'), digest_size=8).hexdigest() + '.arrow'
+        # Non compresso, così il file può essere mappato in memoria alla lettura
+        modulo_feather().write_feather(df, os.path.join(self.cartella, nome_file), compression='uncompressed')
+        self.manifest[nome] = {'file': nome_file, 'chiave': chiave, 'righe': len(df)}
+        self.scrivi_manifest()
+
+    def elimina(self, nome):
+        """Rimuove un indice dall'archivio"""
+        voce = self.manifest.pop(nome, None)
+        if voce is None:
+            return
+        try:
+            os.remove(os.path.join(self.cartella, voce['file']))
+        except OSError:
+            pass
+        self.scrivi_manifest()
+
+    def svuota(self):
+        """Rimuove tutti gli indici dall'archivio"""
+        for nome in list(self.manifest):
+            self.elimina(nome)
+
+    def carica_tutti(self):
+        """Carica tutte le serie archiviate"""
+        dati = {}
+        for nome in self.manifest:
+            try:
+                dati[nome] = self.leggi(nome)
+            except OSError:
+                continue
+        return dati
+
+def pulisci_nome_colonna(nome):
+    """Pulisce il nome della colonna rimuovendo caratteri speciali"""
+    return nome.strip().replace('\n', ' ').replace('\r', '')
+
+MARKER_DATI_STORICI = '=== DATI STORICI ==='
+PREFISSI_METADATA = ('===', 'Nome', 'Ticker', 'Data Download', 'Periodo', 'Numero', 'Performance', 'Prezzo', 'Deviazione')
+# Righe lette da pandas per ogni blocco: limita il picco di memoria sui file molto grandi
+DIMENSIONE_CHUNK = 200_000
+
+# Prima riga dei dati: la riga con il marker (i dati iniziano dalla successiva) oppure la prima
+# riga che non è metadata e il cui primo campo sembra una data (contiene '/' o '-', o solo cifre).
+# Ogni riga è cercata a partire dal '\n' che la precede: con un prefisso letterale il motore
+# regex salta direttamente da una riga all'altra
+RE_INIZIO_DATI = re.compile(
+    rb'\n(?:(?P<marker>[^\n]*' + re.escape(MARKER_DATI_STORICI.encode()) + rb'[^\n]*(?:\n|\Z))'
+    rb'|(?!' + b'|'.join(re.escape(p.encode()) for p in PREFISSI_METADATA) + rb')'
+    rb'[ \t\r\f\v]*(?:[^,\n]*[/-][^,\n]*|\d+[ \t\r\f\v]*),)'
+)
+# Byte letti inizialmente per cercare l'inizio dei dati (raddoppiati se l'intestazione è più lunga)
+BLOCCO_INTESTAZIONE = 64 * 1024
+# Byte massimi esaminati: oltre, il file è letto come CSV normale senza rileggerlo tutto qui
+MAX_BYTES_INTESTAZIONE = 1024 * 1024
+
+def trova_inizio_dati(file):
+    """Restituisce l'offset in byte dei dati storici (-1 se non trovato)
+
+    Cerca con un'unica espressione regolare nei primi BLOCCO_INTESTAZIONE byte, senza
+    esaminare le righe una per una in Python; la finestra si allarga solo se non basta,
+    fino a MAX_BYTES_INTESTAZIONE.
+    """
+    file.seek(0)
+    # Il '\n' iniziale fa da separatore anche per la prima riga: gli offset vanno ridotti di 1
+    testo = b'\n'
+    inizio_ricerca = 0
+    blocco = BLOCCO_INTESTAZIONE
+    while True:
+        blocco = min(blocco, MAX_BYTES_INTESTAZIONE + 1 - len(testo))
+        letti = file.read(blocco)
+        testo += letti
+        fine_file = len(letti) < blocco
+        trovato = RE_INIZIO_DATI.search(testo, inizio_ricerca)
+        if trovato and trovato.group('marker') is None:
+            return trovato.start()
+        # La riga del marker deve essere completa per conoscere l'offset della riga successiva
+        if trovato and (fine_file or testo.endswith(b'\n', 0, trovato.end())):
+            return trovato.end() - 1
+        if fine_file or len(testo) > MAX_BYTES_INTESTAZIONE:
+            return -1
+        # Si riprende dall'ultima riga letta, che può essere troncata
+        inizio_ricerca = trovato.start() if trovato else testo.rfind(b'\n')
+        blocco *= 2
+
+def nomi_colonne(colonne):
+    """Assegna i nomi standard alle colonne lette dal file"""
+    if colonne[0] == 0:  # Significa che non c'erano header
+        if len(colonne) >= 4:
+            return ['Date', 'Price', 'Performance_PCT', 'Performance_ABS'] + [f'Col_{i}' for i in range(4, len(colonne))]
+        return ['Date', 'Price'] + [f'Col_{i}' for i in range(2, len(colonne))]
+    # Rinomina le prime due colonne
+    return ['Date', 'Price'] + [pulisci_nome_colonna(str(col)) for col in colonne[2:]]
+
+# Formati provati in ordine sul campione di date (giorno prima del mese, come nei file italiani)
+FORMATI_DATA = [
+    '%m/%Y',
+    '%Y-%m-%d',
+    '%d/%m/%Y',
+    '%m/%d/%Y',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%Y/%m/%d'
+]
+# Formati ISO: pandas li converte con un percorso veloce dedicato
+FORMATI_ISO = {'%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'}
+RIGHE_CAMPIONE_DATE = 50
+# Formato giorno/mese -> equivalente mese/giorno, da verificare quando il campione è ambiguo
+FORMATI_AMBIGUI = {'%d/%m/%Y': '%m/%d/%Y'}
+
+def rileva_formato_data(date):
+    """Individua il formato delle date da un campione di righe (None se nessun formato noto è valido)"""
+    campione = date.dropna().head(RIGHE_CAMPIONE_DATE)
+    if campione.empty:
+        return None
+    if pd.api.types.is_numeric_dtype(campione):
+        # Timestamp Unix in secondi o millisecondi (valori più piccoli non sono date riconoscibili)
+        if campione.min() < 10**8:
+            return None
+        return 'epoch_ms' if campione.max() >= 10**11 else 'epoch_s'
+    campione = campione.astype(str).str.strip()
+    if campione.str.fullmatch(r'\d{13}').all():
+        return 'epoch_ms'
+    if campione.str.fullmatch(r'\d{9,10}').all():
+        return 'epoch_s'
+    for formato in FORMATI_DATA:
+        try:
+            pd.to_datetime(campione, format=formato)
+        except (ValueError, TypeError):
+            continue
+        if formato in FORMATI_AMBIGUI:
+            return scegli_giorno_mese(date, formato, FORMATI_AMBIGUI[formato])
+        return formato
+    return None
+
+def scegli_giorno_mese(date, giorno_mese, mese_giorno):
+    """Sceglie fra giorno/mese e mese/giorno provandoli su tutti i valori distinti della colonna
+
+    Vince il formato che converte più valori. Se li convertono tutti e due (nessun giorno oltre
+    il 12), il campo che non cambia mai è il giorno, come nei dati mensili datati il primo del
+    mese; solo se resta ambiguo si preferisce giorno/mese, come nei file italiani.
+    """
+    valori = pd.Series(date.dropna().astype(str).str.strip().unique())
+    validi_giorno_mese = pd.to_datetime(valori, format=giorno_mese, errors='coerce').notna().sum()
+    validi_mese_giorno = pd.to_datetime(valori, format=mese_giorno, errors='coerce').notna().sum()
+    if validi_giorno_mese != validi_mese_giorno:
+        return giorno_mese if validi_giorno_mese > validi_mese_giorno else mese_giorno
+    campi = valori.str.split('/', n=2, expand=True)
+    if campi.shape[1] == 3 and campi[1].nunique() == 1 and campi[0].nunique() > 1:
+        return mese_giorno
+    return giorno_mese
+
+def converti_date(date, formato):
+    """Converte una colonna di date con il formato rilevato, convertendo una sola volta i valori ripetuti"""
+    if formato is None:
+        return pd.to_datetime(date, errors='coerce')
+    if formato.startswith('epoch'):
+        return pd.to_datetime(pd.to_numeric(date, errors='coerce'), unit=formato[len('epoch_'):], errors='coerce')
+    if date.dtype != object and not pd.api.types.is_string_dtype(date):
+        date = date.astype(str)
+    # I formati non ISO passano da strptime, lento per elemento: conviene convertire solo i valori
+    # distinti (pochi per i dati mensili). Per gli ISO solo se il campione mostra molte ripetizioni.
+    campione = date.head(1000)
+    if formato not in FORMATI_ISO or campione.nunique() < len(campione) // 2:
+        codici, valori = pd.factorize(date)
+        convertiti = pd.to_datetime(valori, format=formato, errors='coerce').to_numpy()
+        # Il codice -1 (valore mancante) punta al NaT aggiunto in coda
+        convertiti = np.append(convertiti, np.array(['NaT'], dtype=convertiti.dtype))
+        return pd.Series(convertiti[codici], index=date.index)
+    return pd.to_datetime(date, format=formato, errors='coerce')
+
+NS_PER_GIORNO = 86_400 * 10**9
+
+def rileva_periodi_per_anno(date):
+    """Stima il numero di osservazioni per anno dal passo mediano tra le date"""
+    valori = date.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    if len(valori) < 2:
+        return 252
+    passo = np.median(np.diff(valori)) / NS_PER_GIORNO
+    if passo < 1:
+        # Intraday: osservazioni mediane per giorno di contrattazione
+        per_giorno = np.median(np.unique(valori // NS_PER_GIORNO, return_counts=True)[1])
+        return 252 * float(per_giorno)
+    if passo <= 4:
+        # Giornaliero: 252 se mancano i weekend, 365 per le serie quotate tutti i giorni
+        giorno_settimana = (valori // NS_PER_GIORNO + 3) % 7  # 0 = lunedì
+        return 365 if np.mean(giorno_settimana >= 5) > 0.1 else 252
+    if passo <= 10:
+        return 52
+    if passo <= 45:
+        return 12
+    if passo <= 135:
+        return 4
+    return 1
+
+def periodi_per_anno(df):
+    """Restituisce la frequenza annua della serie, calcolandola solo la prima volta"""
+    if 'periodi_anno' not in df.attrs:
+        df.attrs['periodi_anno'] = rileva_periodi_per_anno(df['Date'])
+    return df.attrs['periodi_anno']
+
+def converti_chunk(chunk, formato_data):
+    """Converte Date e Price di un blocco di righe ed elimina le righe non valide"""
+    chunk['Date'] = converti_date(chunk['Date'], formato_data)
+    chunk['Price'] = pd.to_numeric(chunk['Price'], errors='coerce')
+    return chunk.dropna(subset=['Date', 'Price'])
+
+def carica_csv(file):
+    """Carica e valida un file CSV"""
+    try:
+        # Serve un flusso binario con seek per tornare all'inizio dei dati
+        if not hasattr(file, 'seek') or not file.seekable():
+            file = BytesIO(file.read())
+        
+        # Trova l'inizio dei dati storici leggendo solo le righe di intestazione
+        data_start = trova_inizio_dati(file)
+        
+        if data_start == -1:
+            # Fallback: prova a leggere come CSV normale
+            file.seek(0)
+            lettore = pd.read_csv(file, encoding='utf-8', chunksize=DIMENSIONE_CHUNK)
+        else:
+            # Il parser legge direttamente dal flusso, senza copiare il contenuto
+            file.seek(data_start)
+            try:
+                lettore = pd.read_csv(file, header=None, encoding='utf-8', chunksize=DIMENSIONE_CHUNK)
+            except pd.errors.EmptyDataError:
+                return None, "Nessun dato trovato nel file"
+        
+        parti = []
+        colonne = None
+        formato_data = None
+        with lettore:
+            for chunk in lettore:
+                if colonne is None:
+                    # Verifica che abbia almeno 2 colonne
+                    if len(chunk.columns) < 2:
+                        return None, "Il file deve avere almeno 2 colonne (Data e Prezzo)"
+                    colonne = nomi_colonne(list(chunk.columns))
+                chunk.columns = colonne
+                if formato_data is None:
+                    # Il formato delle date si rileva una sola volta sul primo blocco
+                    formato_data = rileva_formato_data(chunk['Date'])
+                parti.append(converti_chunk(chunk, formato_data))
+        
+        if not parti:
+            return None, "Nessun dato trovato nel file"
+        
+        df = pd.concat(parti, ignore_index=True) if len(parti) > 1 else parti[0]
+        
+        # Ordina per data
+        if not df['Date'].is_monotonic_increasing:
+            df = df.sort_values('Date')
+        df = df.reset_index(drop=True)
+        
+        if len(df) < 2:
+            return None, "Il file deve contenere almeno 2 righe valide"
+        
+        # Frequenza della serie, usata per annualizzare volatilità e metriche mobili
+        periodi_per_anno(df)
+        
+        return df, None
+        
+    except Exception as e:
+        return None, f"Errore nel caricamento: {str(e)}"
+
+# Colonne usate dal motore di analisi: le altre si possono scartare nelle serie compattate
+COLONNE_COMPATTE = ['Date', 'Price']
+# Errore relativo massimo ammesso per memorizzare i prezzi in float32
+TOLLERANZA_FLOAT32 = 1e-6
+MODALITA_MEMORIA = {
+    "Completa": None,
+    "Compatta (solo Date e Price)": {},
+    "Compatta con prezzi float32": {'prezzi_float32': True},
+}
+
+def compatta_serie(df, prezzi_float32=False, tolleranza=TOLLERANZA_FLOAT32):
+    """Riduce la memoria di una serie tenendo solo Date e Price, con i prezzi in float32 se richiesto
+
+    I prezzi passano a float32 solo se l'errore relativo massimo resta entro la tolleranza.
+    Se la serie è già nella forma richiesta viene restituito lo stesso oggetto.
+    """
+    prezzi = df['Price'].to_numpy()
+    tipo_prezzi = prezzi.dtype
+    if prezzi_float32 and tipo_prezzi != np.float32:
+        prezzi32 = prezzi.astype(np.float32)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            errore = np.abs(prezzi32.astype(np.float64) - prezzi) / np.abs(prezzi)
+        errore[prezzi == 0] = 0
+        if len(errore) == 0 or np.nanmax(errore) <= tolleranza:
+            tipo_prezzi = np.float32
+    if list(df.columns) == COLONNE_COMPATTE and tipo_prezzi == prezzi.dtype:
+        return df
+    compatta = df[COLONNE_COMPATTE].astype({'Price': tipo_prezzi})
+    compatta.attrs = dict(df.attrs)
+    return compatta
+
+def suffisso_compattazione(compattazione):
+    """Parte della chiave di cache che distingue le serie compattate da quelle complete"""
+    if compattazione is None:
+        return ''
+    return '-compatta' + ''.join(f'-{opzione}={valore}' for opzione, valore in sorted(compattazione.items()))
+
+def nome_da_file(file):
+    """Ricava il nome dell'indice dal nome del file caricato"""
+    return file.name.replace('.csv', '')
+
+def cerca_risultato(file, cache, archivio=None, compattazione=None):
+    """Cerca il file in cache o nell'archivio; restituisce (chiave, sorgente, risultato o None)"""
+    # getbuffer evita di copiare i byte del file caricato solo per calcolarne l'hash
+    contenuto = file.getbuffer() if hasattr(file, 'getbuffer') else file.read()
+    chiave = CacheParsing.chiave(contenuto) + suffisso_compattazione(compattazione)
+    sorgente = file if hasattr(file, 'getbuffer') else BytesIO(contenuto)
+    risultato = cache.get(chiave)
+    if risultato is None and archivio is not None:
+        df = archivio.cerca(chiave)
+        if df is not None:
+            risultato = (df, None)
+            cache.put(chiave, risultato)
+            archivio.salva(nome_da_file(file), df, chiave)
+    return chiave, sorgente, risultato
+
+def registra_risultato(file, chiave, risultato, cache, archivio=None):
+    """Salva in cache (e nell'archivio) il risultato di un file appena analizzato"""
+    cache.put(chiave, risultato)
+    if archivio is not None and risultato[0] is not None:
+        archivio.salva(nome_da_file(file), risultato[0], chiave)
+
+# Righe finali confrontate per verificare che il nuovo file estenda la serie già caricata
+RIGHE_CONTROLLO_CODA = 5
+BLOCCO_CODA = 64 * 1024
+
+def carica_incrementale(file, df_esistente, compatta=False):
+    """Aggiunge a df_esistente solo le righe del file successive alla sua ultima data
+
+    Il file viene letto a ritroso a blocchi finché la coda contiene le ultime righe già caricate;
+    se date e prezzi coincidono vengono analizzate e aggiunte solo le righe nuove. Con compatta
+    della coda si tengono solo le colonne di una serie compattata. Restituisce None quando la
+    sovrapposizione non è verificabile e serve il parsing completo.
+    """
+    try:
+        ultima_data = df_esistente['Date'].iloc[-1]
+        righe_controllo = min(RIGHE_CONTROLLO_CODA, len(df_esistente))
+        file.seek(0, os.SEEK_END)
+        fine = file.tell()
+        blocco = BLOCCO_CODA
+        
+        while True:
+            inizio = max(0, fine - blocco)
+            if inizio == 0:
+                # La coda coprirebbe tutto il file (intestazione compresa): meglio il parsing completo
+                return None
+            file.seek(inizio)
+            # La prima riga del blocco è probabilmente troncata
+            righe = file.read(fine - inizio).split(b'\n')[1:]
+            coda = pd.read_csv(BytesIO(b'\n'.join(righe)), header=None)
+            coda.columns = nomi_colonne(list(coda.columns))
+            # Una serie compattata si estende con le sole colonne che conserva
+            if list(coda.columns) != list(df_esistente.columns):
+                if not compatta or list(df_esistente.columns) != COLONNE_COMPATTE:
+                    return None
+                coda = coda[COLONNE_COMPATTE]
+            coda = converti_chunk(coda, rileva_formato_data(coda['Date']))
+            if (coda['Date'] <= ultima_data).sum() >= righe_controllo:
+                break
+            blocco *= 2
+        
+        if not coda['Date'].is_monotonic_increasing:
+            return None
+        
+        # La coda già nota deve coincidere con le ultime righe caricate
+        gia_note = coda[coda['Date'] <= ultima_data].tail(righe_controllo)
+        attese = df_esistente.tail(righe_controllo)
+        if not np.array_equal(
+            gia_note['Date'].to_numpy(dtype='datetime64[ns]'), attese['Date'].to_numpy(dtype='datetime64[ns]')
+        ) or not np.allclose(
+            # Confronto nella precisione della serie caricata (float32 se compattata)
+            gia_note['Price'].to_numpy(dtype=attese['Price'].dtype), attese['Price'].to_numpy(), rtol=1e-9, atol=0
+        ):
+            return None
+        
+        nuove = coda[coda['Date'] > ultima_data]
+        if nuove.empty:
+            return df_esistente
+        df = pd.concat([df_esistente, nuove], ignore_index=True)
+        df.attrs = dict(df_esistente.attrs)
+        return df
+    except Exception:
+        return None
+
+def ha_forma_richiesta(df, compattazione):
+    """Vero se la serie è già nella forma che compattazione produrrebbe (completa se None)"""
+    # compatta_serie non riporta a float64 i prezzi già ridotti a float32
+    if df['Price'].dtype != np.float64 and not (compattazione or {}).get('prezzi_float32'):
+        return False
+    return compattazione is None or compatta_serie(df, **compattazione) is df
+
+def analizza_cronometrato(sorgente, df_esistente=None, compattazione=None):
+    """Analizza un flusso (in modo incrementale se possibile) e restituisce risultato, secondi e origine
+
+    L'aggiornamento incrementale estende la serie già caricata, quindi si tenta solo se questa
+    ha già la forma richiesta: cambiando modalità di memoria il file viene riletto per intero.
+    """
+    inizio = time.perf_counter()
+    risultato, origine = None, 'incrementale'
+    if df_esistente is not None and ha_forma_richiesta(df_esistente, compattazione):
+        df = carica_incrementale(sorgente, df_esistente, compattazione is not None)
+        if df is not None:
+            risultato = (df, None)
+    if risultato is None:
+        sorgente.seek(0)
+        risultato, origine = carica_csv(sorgente), 'parsing'
+    if risultato[0] is not None and compattazione is not None:
+        risultato = (compatta_serie(risultato[0], **compattazione), None)
+    return risultato, time.perf_counter() - inizio, origine
+
+def carica_files_in_parallelo(files, cache, archivio=None, max_workers=None, dati_esistenti=None, compattazione=None):
+    """Carica più file CSV in parallelo con un pool di thread
+
+    Cache e archivio vengono consultati e aggiornati solo nel thread principale; il parsing dei
+    file non ancora visti è distribuito sul pool. Un file con lo stesso nome di una serie in
+    dati_esistenti viene prima provato in modo incrementale. Con compattazione (opzioni di
+    compatta_serie) le serie vengono compattate prima di entrare in cache. Restituisce, nell'ordine
+    dei file, tuple (nome, df, errore, secondi, origine) con origine 'cache', 'incrementale' o 'parsing'.
+    """
+    dati_esistenti = dati_esistenti or {}
+    risultati = [None] * len(files)
+    da_analizzare = []
+    
+    for i, file in enumerate(files):
+        inizio = time.perf_counter()
+        chiave, sorgente, risultato = cerca_risultato(file, cache, archivio, compattazione)
+        if risultato is not None:
+            risultati[i] = (nome_da_file(file), *risultato, time.perf_counter() - inizio, 'cache')
+        else:
+            da_analizzare.append((i, file, chiave, sorgente))
+    
+    if da_analizzare:
+        if max_workers is None:
+            max_workers = min(len(da_analizzare), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # map restituisce i risultati nello stesso ordine dei file
+            analizzati = pool.map(
+                analizza_cronometrato,
+                [sorgente for _, _, _, sorgente in da_analizzare],
+                [dati_esistenti.get(nome_da_file(file)) for _, file, _, _ in da_analizzare],
+                [compattazione] * len(da_analizzare)
+            )
+            for (i, file, chiave, _), (risultato, secondi, origine) in zip(da_analizzare, analizzati):
+                registra_risultato(file, chiave, risultato, cache, archivio)
+                risultati[i] = (nome_da_file(file), *risultato, secondi, origine)
+    
+    return risultati
+
+# Funzioni per calcolare performance
+def calcola_performance(prezzo_inizio, prezzo_fine):
+    """Calcola la performance percentuale"""
+    if pd.isna(prezzo_inizio) or pd.isna(prezzo_fine) or prezzo_inizio == 0:
+        return np.nan
+    return ((prezzo_fine - prezzo_inizio) / prezzo_inizio) * 100
+
+def calcola_rendimento_annualizzato(prezzo_inizio, prezzo_fine, anni):
+    """Calcola il rendimento medio annuo"""
+    if pd.isna(prezzo_inizio) or pd.isna(prezzo_fine) or prezzo_inizio == 0 or anni <= 0:
+        return np.nan
+    return (((prezzo_fine / prezzo_inizio) ** (1/anni)) - 1) * 100
+
+def calcola_volatilita(prezzi, periodi_anno=252):
+    """Calcola la volatilità annualizzata"""
+    if len(prezzi) < 2:
+        return np.nan
+    rendimenti = prezzi.pct_change().dropna()
+    return rendimenti.std() * np.sqrt(periodi_anno) * 100
+
+def calcola_volatilita_indici(dati, indici):
+    """Calcola la volatilità annualizzata di più indici in un solo passaggio vettoriale"""
+    prezzi = [dati[nome]['Price'].to_numpy(dtype=np.float64) for nome in indici]
+    lunghezze = np.array([len(p) for p in prezzi])
+    if len(prezzi) == 0:
+        return pd.Series(dtype=np.float64)
+    
+    # Rendimenti di tutte le serie concatenate, scartando quelli a cavallo tra due serie
+    tutti = np.concatenate(prezzi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rendimenti = tutti[1:] / tutti[:-1] - 1
+    validi = np.ones(len(rendimenti), dtype=bool)
+    validi[np.cumsum(lunghezze)[:-1] - 1] = False
+    rendimenti = rendimenti[validi]
+    
+    conteggi = np.maximum(lunghezze - 1, 0)
+    serie = np.repeat(np.arange(len(indici)), conteggi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        medie = np.bincount(serie, weights=rendimenti, minlength=len(indici)) / conteggi
+        scarti = np.bincount(serie, weights=(rendimenti - medie[serie]) ** 2, minlength=len(indici))
+        deviazioni = np.sqrt(scarti / (conteggi - 1))
+    deviazioni[(conteggi < 2) | ~np.isfinite(deviazioni)] = np.nan
+    
+    fattori = np.array([periodi_per_anno(dati[nome]) for nome in indici], dtype=np.float64)
+    return pd.Series(deviazioni * np.sqrt(fattori) * 100, index=indici)
+
+# Celle (righe × indici) della matrice elaborata per volta nel calcolo dei drawdown:
+# limita la memoria, che con le matrici intermedie è circa 50 byte per cella
+CELLE_PER_BLOCCO_DRAWDOWN = 1_000_000
+
+def blocchi_per_lunghezza(lunghezze, celle_per_blocco):
+    """Raggruppa le posizioni delle serie, dalla più lunga, in blocchi di al più celle_per_blocco celle
+
+    Ogni blocco è completato alla lunghezza della sua prima serie, quindi ordinare per lunghezza
+    evita che una serie lunga gonfi la matrice di tante serie corte. Una serie più lunga del
+    limite forma un blocco da sola.
+    """
+    ordine = np.argsort(-np.asarray(lunghezze), kind='stable')
+    blocchi = []
+    inizio = 0
+    while inizio < len(ordine):
+        righe = max(int(lunghezze[ordine[inizio]]), 1)
+        fine = inizio + max(celle_per_blocco // righe, 1)
+        blocchi.append(ordine[inizio:fine])
+        inizio = fine
+    return blocchi
+
+def calcola_drawdown_indici(dati, indici):
+    """Calcola massimo drawdown, durata, tempo di recupero e drawdown attuale di più indici
+
+    Le serie di lunghezza simile sono affiancate per posizione in una matrice (le più corte
+    completate con NaN) e il massimo corrente di tutte le colonne si ottiene con un solo
+    np.maximum.accumulate. Durata (dal massimo al minimo) e recupero (dal minimo al ritorno
+    sul massimo) sono in giorni; il recupero è NaN se la serie non è ancora tornata sul
+    massimo precedente.
+    """
+    colonne = ["max_drawdown", "durata_drawdown", "recupero_drawdown", "drawdown_attuale"]
+    risultati = np.full((len(indici), len(colonne)), np.nan)
+    tutte_lunghezze = np.array([len(dati[nome]) for nome in indici], dtype=np.int64)
+    
+    for posizioni_blocco in blocchi_per_lunghezza(tutte_lunghezze, CELLE_PER_BLOCCO_DRAWDOWN):
+        blocco = [indici[i] for i in posizioni_blocco]
+        lunghezze = tutte_lunghezze[posizioni_blocco]
+        righe = int(lunghezze.max())
+        if righe == 0:
+            continue
+        prezzi = np.full((righe, len(blocco)), np.nan)
+        date = np.zeros((righe, len(blocco)), dtype=np.int64)
+        for j, nome in enumerate(blocco):
+            prezzi[:lunghezze[j], j] = dati[nome]['Price'].to_numpy(dtype=np.float64)
+            date[:lunghezze[j], j] = dati[nome]['Date'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        
+        posizioni = np.arange(righe)[:, None]
+        colonna = np.arange(len(blocco))
+        # Il NaN di riempimento sta solo in coda, quindi non altera il massimo delle righe valide
+        massimi = np.maximum.accumulate(prezzi, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drawdown = prezzi / massimi - 1
+        drawdown[np.isnan(drawdown)] = 0.0
+        
+        # Minimo del drawdown peggiore e massimo da cui è partito (ultima riga con prezzo = massimo)
+        minimo = drawdown.argmin(axis=0)
+        riga_massimo = np.maximum.accumulate(np.where(prezzi == massimi, posizioni, 0), axis=0)
+        massimo = riga_massimo[minimo, colonna]
+        # Recupero: prima riga dopo il minimo con prezzo di nuovo al livello del massimo
+        recuperati = (posizioni > minimo) & (prezzi >= massimi[minimo, colonna])
+        ha_recuperato = recuperati.any(axis=0)
+        recupero = recuperati.argmax(axis=0)
+        
+        peggiore = drawdown[minimo, colonna]
+        giorni_recupero = np.where(ha_recuperato, (date[recupero, colonna] - date[minimo, colonna]) / NS_PER_GIORNO, np.nan)
+        
+        righe_blocco = posizioni_blocco
+        risultati[righe_blocco, 0] = peggiore * 100
+        risultati[righe_blocco, 1] = (date[minimo, colonna] - date[massimo, colonna]) / NS_PER_GIORNO
+        # Una serie senza drawdown non ha nulla da recuperare
+        risultati[righe_blocco, 2] = np.where(peggiore == 0, 0.0, giorni_recupero)
+        risultati[righe_blocco, 3] = drawdown[lunghezze - 1, colonna] * 100
+    
+    return pd.DataFrame(risultati, index=list(indici), columns=colonne)
+
+# Metriche mobili disponibili (etichetta -> metrica) e durate della finestra in anni
+METRICHE_MOBILI = {
+    "Rendimento mobile (%)": "rendimento",
+    "Volatilità mobile annualizzata (%)": "volatilita",
+    "Drawdown dal massimo mobile (%)": "drawdown"
+}
+FINESTRE_MOBILI = {
+    "3 mesi": 0.25,
+    "6 mesi": 0.5,
+    "1 anno": 1,
+    "3 anni": 3,
+    "5 anni": 5
+}
+
+def righe_per_finestra(date, anni):
+    """Converte una durata in anni nel numero di righe equivalenti alla frequenza delle date"""
+    return max(2, int(round(anni * rileva_periodi_per_anno(date))))
+
+def rendimenti_mobili(prezzi, finestra):
+    """Rendimento percentuale sulle ultime finestra righe per ogni colonna di una matrice di prezzi"""
+    risultato = np.full(prezzi.shape, np.nan)
+    if finestra < len(prezzi):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            risultato[finestra:] = (prezzi[finestra:] / prezzi[:-finestra] - 1) * 100
+    return risultato
+
+def centra_validi(valori, validi):
+    """Sottrae a ogni colonna la media dei suoi valori validi, lasciando a zero le celle non valide
+
+    Centrare non cambia varianze e covarianze ma limita la cancellazione numerica nelle
+    differenze fra somme; gli zeri non contano nelle somme delle sole celle valide.
+    """
+    centrati = np.where(validi, valori, 0.0)
+    centrati -= centrati.sum(axis=0) / np.maximum(validi.sum(axis=0), 1)
+    centrati[~validi] = 0.0
+    return centrati
+
+def somme_cumulate(valori):
+    """Somme cumulative per colonna precedute da una riga di zeri (float64)"""
+    risultato = np.zeros((len(valori) + 1, valori.shape[1]))
+    np.cumsum(valori, axis=0, out=risultato[1:])
+    return risultato
+
+def somme_mobili(valori, finestra):
+    """Somme per colonna di ogni finestra di righe consecutive (una riga per finestra completa)"""
+    cumulate = somme_cumulate(valori)
+    return cumulate[finestra:] - cumulate[:-finestra]
+
+def volatilita_mobile(prezzi, finestra, periodi_anno, osservati=None):
+    """Volatilità annualizzata dei rendimenti logaritmici sulle ultime finestra righe, in O(n)
+
+    Somme e somme dei quadrati mobili si ottengono come differenze di somme cumulative, sui
+    rendimenti centrati con centra_validi.
+    Con osservati (matrice booleana) i rendimenti sono solo quelli fra due quotazioni reali,
+    così i giorni riempiti con l'ultimo prezzo noto non abbassano la volatilità.
+    """
+    n, k = prezzi.shape
+    risultato = np.full((n, k), np.nan)
+    if n < 2 or finestra >= n:
+        return risultato
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rendimenti = np.log(prezzi[1:] / prezzi[:-1])
+    if osservati is not None:
+        rendimenti[~osservati[1:]] = np.nan
+    validi = np.isfinite(rendimenti)
+    rendimenti = centra_validi(rendimenti, validi)
+    
+    # Somma(i-finestra, i] = c[i] - c[i-finestra]
+    conteggi = somme_cumulate(validi)
+    somme = somme_cumulate(rendimenti)
+    np.square(rendimenti, out=rendimenti)
+    quadrati = somme_cumulate(rendimenti)
+    conteggio = conteggi[finestra:] - conteggi[:-finestra]
+    somma = somme[finestra:] - somme[:-finestra]
+    quadrato = quadrati[finestra:] - quadrati[:-finestra]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        varianza = (quadrato - somma ** 2 / conteggio) / (conteggio - 1)
+    varianza[conteggio < 2] = np.nan
+    # Il rendimento i (fra le righe i e i+1) chiude la finestra che termina alla riga i+1
+    risultato[finestra:] = np.sqrt(np.maximum(varianza, 0)) * np.sqrt(periodi_anno) * 100
+    return risultato
+
+def massimo_mobile(valori, finestra):
+    """Massimo sulle ultime finestra righe di ogni colonna in O(n) (algoritmo di van Herk/Gil-Werman)
+
+    Le righe sono divise in blocchi lunghi quanto la finestra: ogni finestra copre la coda di un
+    blocco e l'inizio del successivo, quindi il suo massimo combina un massimo cumulativo
+    all'indietro e uno in avanti. Le prime finestra-1 righe sono NaN.
+    """
+    n, k = valori.shape
+    risultato = np.full((n, k), np.nan)
+    if finestra > n:
+        return risultato
+    blocchi = -(-n // finestra)
+    riempiti = np.vstack([valori, np.full((blocchi * finestra - n, k), -np.inf)]).reshape(blocchi, finestra, k)
+    in_avanti = np.maximum.accumulate(riempiti, axis=1).reshape(-1, k)[:n]
+    all_indietro = np.maximum.accumulate(riempiti[:, ::-1], axis=1)[:, ::-1].reshape(-1, k)[:n]
+    risultato[finestra - 1:] = np.maximum(all_indietro[:n - finestra + 1], in_avanti[finestra - 1:])
+    return risultato
+
+def drawdown_mobile(prezzi, finestra):
+    """Distanza percentuale di ogni prezzo dal massimo delle ultime finestra righe"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (prezzi / massimo_mobile(prezzi, finestra) - 1) * 100
+
+def calcola_metrica_mobile(panel, metrica, finestra, periodi_anno):
+    """Calcola una metrica mobile per tutte le colonne del panel in un solo passaggio vettoriale
+
+    I buchi del panel (date in cui un indice non quota) sono riempiti con l'ultimo prezzo noto,
+    così la finestra copre la stessa durata per tutti gli indici. periodi_anno contiene la
+    frequenza annua di ciascun indice, usata per annualizzare la volatilità.
+    """
+    prezzi = panel.ffill().to_numpy(dtype=np.float64)
+    if metrica == "rendimento":
+        valori = rendimenti_mobili(prezzi, finestra)
+    elif metrica == "volatilita":
+        osservati = panel.notna().to_numpy()
+        valori = volatilita_mobile(prezzi, finestra, np.asarray(periodi_anno, dtype=np.float64), osservati)
+    elif metrica == "drawdown":
+        valori = drawdown_mobile(prezzi, finestra)
+    else:
+        raise ValueError(f"Metrica mobile sconosciuta: {metrica}")
+    return pd.DataFrame(valori, index=panel.index, columns=panel.columns)
+
+# Orizzonti della tabella performance (etichetta -> giorni)
+PERIODI = {
+    "1M": 30,
+    "3M": 90,
+    "6M": 180,
+    "1A": 365,
+    "3A": 1095,
+    "5A": 1825
+}
+
+
+def trova_indici_piu_vicini(date_ns, target_ns):
+    """Restituisce, per ogni data target, la posizione della data più vicina in un array ordinato"""
+    n = len(date_ns)
+    pos = np.searchsorted(date_ns, target_ns, side='left')
+    sinistra = np.clip(pos - 1, 0, n - 1)
+    destra = np.clip(pos, 0, n - 1)
+    # Distanza in giorni interi come in (Date - target).dt.days
+    giorni_sinistra = (date_ns[sinistra] - target_ns) // NS_PER_GIORNO
+    giorni_destra = (date_ns[destra] - target_ns) // NS_PER_GIORNO
+    # A parità di distanza vince la data più vecchia (stesso risultato di idxmin)
+    giorni = np.where(np.abs(giorni_destra) < np.abs(giorni_sinistra), giorni_destra, giorni_sinistra)
+    # Prima riga che cade nello stesso giorno di distanza
+    return np.searchsorted(date_ns, target_ns + giorni * NS_PER_GIORNO, side='left')
+
+def get_prezzo_per_periodo(df, giorni_fa):
+    """Ottiene il prezzo più vicino a X giorni fa"""
+    data_target = np.datetime64(datetime.now() - timedelta(days=giorni_fa), 'ns').astype(np.int64)
+    date_ns = df['Date'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    idx = trova_indici_piu_vicini(date_ns, np.array([data_target]))[0]
+    return df['Price'].iloc[idx], df['Date'].iloc[idx]
+
+def calcola_orizzonti(dati, indici, periodi, data_riferimento=None):
+    """Calcola prezzi, date e performance di inizio periodo per tutti gli orizzonti e gli indici
+
+    Restituisce tre DataFrame orizzonti × indici: prezzi di inizio, date di inizio e
+    performance percentuale rispetto all'ultimo prezzo disponibile.
+    """
+    if data_riferimento is None:
+        data_riferimento = datetime.now()
+    etichette = list(periodi.keys())
+    target_ns = np.array(
+        [np.datetime64(data_riferimento - timedelta(days=giorni), 'ns') for giorni in periodi.values()]
+    ).astype(np.int64)
+
+    prezzi_inizio = np.full((len(etichette), len(indici)), np.nan)
+    date_inizio = np.full((len(etichette), len(indici)), np.datetime64('NaT'), dtype='datetime64[ns]')
+    prezzi_attuali = np.full(len(indici), np.nan)
+
+    for j, nome_indice in enumerate(indici):
+        df = dati[nome_indice]
+        if len(df) == 0:
+            continue
+        date_ns = df['Date'].to_numpy(dtype='datetime64[ns]')
+        prezzi = df['Price'].to_numpy(dtype=np.float64)
+        idx = trova_indici_piu_vicini(date_ns.astype(np.int64), target_ns)
+        prezzi_inizio[:, j] = prezzi[idx]
+        date_inizio[:, j] = date_ns[idx]
+        prezzi_attuali[j] = prezzi[-1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        performance = (prezzi_attuali - prezzi_inizio) / prezzi_inizio * 100
+    performance[prezzi_inizio == 0] = np.nan
+
+    return (
+        pd.DataFrame(prezzi_inizio, index=etichette, columns=indici),
+        pd.DataFrame(date_inizio, index=etichette, columns=indici),
+        pd.DataFrame(performance, index=etichette, columns=indici)
+    )
+
+def calcola_statistiche(dati, indici, data_riferimento):
+    """Calcola le statistiche di ciascun indice (orizzonti, volatilità, CAGR, YTD, min/max, primo/ultimo)"""
+    prezzi_inizio, _, perf_orizzonti = calcola_orizzonti(dati, indici, PERIODI, data_riferimento)
+    volatilita = calcola_volatilita_indici(dati, indici)
+    drawdown = calcola_drawdown_indici(dati, indici)
+    inizio_anno = np.datetime64(datetime(data_riferimento.year, 1, 1), 'ns')
+    fine_anno = np.datetime64(datetime(data_riferimento.year + 1, 1, 1), 'ns')
+    statistiche = {}
+    
+    for nome_indice in indici:
+        df = dati[nome_indice]
+        # In float64 anche per le serie compattate con prezzi float32
+        prezzi = df['Price'].astype(np.float64, copy=False)
+        date = df['Date'].to_numpy(dtype='datetime64[ns]')
+        prezzo_primo, prezzo_ultimo = prezzi.iloc[0], prezzi.iloc[-1]
+        data_primo, data_ultimo = df['Date'].iloc[0], df['Date'].iloc[-1]
+        
+        # Primo prezzo dell'anno corrente
+        pos_anno = np.searchsorted(date, inizio_anno)
+        perf_ytd = np.nan
+        if pos_anno < len(date) and date[pos_anno] < fine_anno:
+            perf_ytd = calcola_performance(prezzi.iloc[pos_anno], prezzo_ultimo)
+        
+        anni = (data_ultimo - data_primo).days / 365.25
+        
+        statistiche[nome_indice] = {
+            "righe": len(df),
+            "prezzo_primo": prezzo_primo,
+            "data_primo": data_primo,
+            "prezzo_ultimo": prezzo_ultimo,
+            "data_ultimo": data_ultimo,
+            "prezzo_min": prezzi.min(),
+            "prezzo_max": prezzi.max(),
+            "performance": perf_orizzonti[nome_indice].to_dict(),
+            "rend_5a": calcola_rendimento_annualizzato(prezzi_inizio.at["5A", nome_indice], prezzo_ultimo, 5),
+            "cagr": calcola_rendimento_annualizzato(prezzo_primo, prezzo_ultimo, anni),
+            "volatilita": volatilita[nome_indice],
+            "max_drawdown": drawdown.at[nome_indice, "max_drawdown"],
+            "durata_drawdown": drawdown.at[nome_indice, "durata_drawdown"],
+            "recupero_drawdown": drawdown.at[nome_indice, "recupero_drawdown"],
+            "drawdown_attuale": drawdown.at[nome_indice, "drawdown_attuale"],
+            "periodi_anno": periodi_per_anno(df),
+            "perf_ytd": perf_ytd
+        }
+    
+    return statistiche
+
+def statistiche_indici(dati, indici, cache, data_riferimento):
+    """Restituisce le statistiche degli indici ricalcolando solo quelle dei DataFrame cambiati
+
+    La cache conserva per ogni indice il DataFrame da cui sono state calcolate: le statistiche
+    restano valide finché in dati c'è lo stesso oggetto e la data di riferimento non cambia.
+    """
+    for nome in list(cache):
+        if nome not in dati:
+            del cache[nome]
+    
+    da_calcolare = [
+        nome for nome in indici
+        if nome not in cache or cache[nome][0] is not dati[nome] or cache[nome][1] != data_riferimento
+    ]
+    if da_calcolare:
+        for nome, stat in calcola_statistiche(dati, da_calcolare, data_riferimento).items():
+            cache[nome] = (dati[nome], data_riferimento, stat)
+    
+    return {nome: cache[nome][2] for nome in indici}
+
+# Colonne percentuali della tabella risultati (float64, NaN se non disponibili)
+COLONNE_PERCENTUALI = [f"Performance {periodo}" for periodo in PERIODI] + [
+    "Rend. Medio 5A (%)", "CAGR Storico (%)", "Volatilità (%)", "Max Drawdown (%)", "Drawdown Attuale (%)"
+]
+# Colonne in giorni del drawdown massimo (NaN se il recupero non è ancora avvenuto)
+COLONNE_GIORNI = ["Durata Max DD (giorni)", "Recupero Max DD (giorni)"]
+
+def tabella_risultati(statistiche, indici):
+    """Costruisce la tabella numerica dei risultati (una riga per indice)"""
+    risultati = []
+    
+    for nome_indice in indici:
+        stat = statistiche[nome_indice]
+        riga = {"Indice": nome_indice}
+        
+        # Performance per diversi periodi
+        for periodo_nome in PERIODI:
+            riga[f"Performance {periodo_nome}"] = stat["performance"][periodo_nome]
+        
+        # Rendimenti annualizzati
+        riga["Rend. Medio 5A (%)"] = stat["rend_5a"]
+        riga["CAGR Storico (%)"] = stat["cagr"]
+        
+        # Volatilità annualizzata
+        riga["Volatilità (%)"] = stat["volatilita"]
+        
+        # Drawdown
+        riga["Max Drawdown (%)"] = stat["max_drawdown"]
+        riga["Drawdown Attuale (%)"] = stat["drawdown_attuale"]
+        riga["Durata Max DD (giorni)"] = stat["durata_drawdown"]
+        riga["Recupero Max DD (giorni)"] = stat["recupero_drawdown"]
+        
+        # Informazioni aggiuntive
+        riga["Prezzo Attuale"] = stat["prezzo_ultimo"]
+        riga["Data Ultimo"] = stat["data_ultimo"]
+        
+        risultati.append(riga)
+    
+    colonne_numeriche = COLONNE_PERCENTUALI + COLONNE_GIORNI + ["Prezzo Attuale"]
+    df_risultati = pd.DataFrame(risultati, columns=["Indice"] + colonne_numeriche + ["Data Ultimo"])
+    df_risultati[colonne_numeriche] = df_risultati[colonne_numeriche].astype(np.float64)
+    # Tipizzata anche quando la tabella è vuota, altrimenti resta di tipo object
+    df_risultati["Data Ultimo"] = pd.to_datetime(df_risultati["Data Ultimo"])
+    return df_risultati
+
+def formatta_percentuale(valore):
+    """Formatta un valore percentuale per la tabella risultati"""
+    return f"{valore:.2f}%" if not pd.isna(valore) else "N/A"
+
+def formatta_risultati(df_risultati):
+    """Converte la tabella numerica dei risultati nel formato testuale usato per l'export"""
+    df = df_risultati.copy()
+    for colonna in COLONNE_PERCENTUALI:
+        df[colonna] = df[colonna].map(formatta_percentuale)
+    for colonna in COLONNE_GIORNI:
+        df[colonna] = df[colonna].map(lambda valore: f"{valore:.0f}" if not pd.isna(valore) else "N/A")
+    df["Prezzo Attuale"] = df["Prezzo Attuale"].map(lambda valore: f"{valore:.2f}")
+    df["Data Ultimo"] = df["Data Ultimo"].dt.strftime('%Y-%m-%d')
+    return df
+
+# Modalità di allineamento delle date nel panel (etichetta -> modalità)
+ALLINEAMENTI = {
+    "Unione delle date": "unione",
+    "Date comuni": "intersezione",
+    "Ultimo prezzo noto (as-of)": "asof"
+}
+# Voci conservate da ciascuna cache di risultati derivati (panel, correlazioni, tracce)
+MAX_VOCI_IN_CACHE = 8
+
+def cerca_in_cache(cache, chiave, origini):
+    """Valore in cache se è stato calcolato dagli stessi oggetti origini (confrontati per identità)
+
+    La cache è un OrderedDict usato come LRU: la voce trovata diventa la più recente.
+    """
+    voce = cache.get(chiave)
+    if voce is None or len(voce[0]) != len(origini) or any(a is not b for a, b in zip(voce[0], origini)):
+        return None
+    cache.move_to_end(chiave)
+    return voce[1]
+
+def salva_in_cache(cache, chiave, origini, valore):
+    """Salva il valore con gli oggetti da cui è calcolato, scartando le voci meno recenti"""
+    cache[chiave] = (tuple(origini), valore)
+    cache.move_to_end(chiave)
+    while len(cache) > MAX_VOCI_IN_CACHE:
+        cache.popitem(last=False)
+    return valore
+
+def costruisci_panel(dati, indici, allineamento="unione"):
+    """Costruisce la matrice date × indici dei prezzi (float64) con le date allineate
+
+    - unione: tutte le date di tutte le serie, NaN dove un indice non ha quotazione
+    - intersezione: solo le date presenti in tutte le serie
+    - asof: tutte le date, con l'ultimo prezzo noto di ciascun indice a quella data
+    """
+    date_serie = [dati[nome]['Date'].to_numpy(dtype='datetime64[ns]') for nome in indici]
+    prezzi_serie = [dati[nome]['Price'].to_numpy(dtype=np.float64) for nome in indici]
+    
+    if allineamento == "intersezione":
+        date = reduce(np.intersect1d, date_serie)
+    else:
+        date = np.unique(np.concatenate(date_serie))
+    if len(date) == 0:
+        # Nessuna data comune: panel vuoto con le colonne degli indici
+        return pd.DataFrame(
+            np.empty((0, len(indici))), index=pd.DatetimeIndex(date, name='Date'), columns=list(indici)
+        )
+    
+    valori = np.full((len(date), len(indici)), np.nan)
+    for j, (date_indice, prezzi) in enumerate(zip(date_serie, prezzi_serie)):
+        if allineamento == "asof":
+            pos = np.searchsorted(date_indice, date, side='right') - 1
+            valori[:, j] = np.where(pos >= 0, prezzi[np.maximum(pos, 0)], np.nan)
+        else:
+            pos = np.searchsorted(date, date_indice)
+            presenti = (pos < len(date)) & (date[np.minimum(pos, len(date) - 1)] == date_indice)
+            valori[pos[presenti], j] = prezzi[presenti]
+    
+    return pd.DataFrame(valori, index=pd.DatetimeIndex(date, name='Date'), columns=list(indici))
+
+def panel_indici(dati, indici, allineamento, cache):
+    """Restituisce il panel degli indici, ricostruendolo solo se selezione o DataFrame sono cambiati"""
+    chiave = (tuple(indici), allineamento)
+    origini = [dati[nome] for nome in indici]
+    panel = cerca_in_cache(cache, chiave, origini)
+    if panel is None:
+        panel = salva_in_cache(cache, chiave, origini, costruisci_panel(dati, indici, allineamento))
+    return panel
+
+def ribasa_a_100(panel, inizio_comune=False):
+    """Ribasa a 100 tutte le colonne del panel con un'unica operazione vettoriale
+
+    Con inizio_comune le curve partono dalla data di inizio più recente fra gli indici e la
+    base di ogni indice è il suo ultimo prezzo noto a quella data (anche se quel giorno non
+    quota), così partono dallo stesso punto e sono direttamente confrontabili.
+    """
+    if panel.empty:
+        return panel.copy()
+    valori = panel.to_numpy(dtype=np.float64)
+    date = panel.index
+    validi = ~np.isnan(valori)
+    colonne = np.arange(valori.shape[1])
+    # Primo prezzo disponibile di ogni colonna (NaN per le colonne vuote)
+    base = valori[validi.argmax(axis=0), colonne]
+    
+    if inizio_comune:
+        colonne_con_dati = validi.any(axis=0)
+        if colonne_con_dati.any():
+            inizio = validi.argmax(axis=0)[colonne_con_dati].max()
+            # Ultima riga con un prezzo fino alla data di inizio comune (prezzo as-of)
+            ultime = np.where(validi[:inizio + 1], np.arange(inizio + 1)[:, None], 0).max(axis=0)
+            base = np.where(colonne_con_dati, valori[ultime, colonne], np.nan)
+            valori, date = valori[inizio:], date[inizio:]
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ribasati = valori / base * 100
+    return pd.DataFrame(ribasati, index=date, columns=panel.columns)
+
+# Frequenza dei rendimenti per correlazioni e covarianze (etichetta -> regola di resample)
+FREQUENZE_RENDIMENTI = {
+    "Giornaliera": None,
+    "Settimanale": "W-FRI",
+    "Mensile": "ME"
+}
+PERIODI_ANNO_FREQUENZA = {"W-FRI": 52, "ME": 12}
+# Storico usato per la matrice (etichetta -> anni, None per tutto lo storico)
+FINESTRE_CORRELAZIONE = {
+    "1 anno": 1,
+    "3 anni": 3,
+    "5 anni": 5,
+    "10 anni": 10,
+    "Tutto lo storico": None
+}
+MIN_OSSERVAZIONI_CORRELAZIONE = 3
+
+def rendimenti_periodici(panel, frequenza=None):
+    """Rendimenti semplici del panel alla frequenza richiesta (None: una riga per data del panel)
+
+    Il rendimento di un periodo è NaN se l'indice non ha quotazioni reali nel periodo, così i
+    prezzi riportati in avanti non producono rendimenti nulli fittizi.
+    """
+    if frequenza is None:
+        osservati = panel.notna()
+        prezzi = panel.ffill()
+    else:
+        # Anche i periodi senza alcuna data nel panel ereditano l'ultimo prezzo noto
+        osservati = panel.notna().resample(frequenza).sum() > 0
+        prezzi = panel.ffill().resample(frequenza).last().ffill()
+    valori = prezzi.to_numpy(dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rendimenti = valori[1:] / valori[:-1] - 1
+    rendimenti[~osservati.to_numpy(dtype=bool)[1:] | ~np.isfinite(rendimenti)] = np.nan
+    return pd.DataFrame(rendimenti, index=prezzi.index[1:], columns=panel.columns)
+
+def matrici_covarianza(rendimenti, periodi_anno=1):
+    """Correlazione e covarianza (annualizzata con periodi_anno) di tutte le coppie di colonne
+
+    Usa per ogni coppia le sole date in cui entrambe le colonne hanno un rendimento, come
+    DataFrame.corr, ma con cinque prodotti matriciali invece di un ciclo sulle coppie.
+    """
+    valori = rendimenti.to_numpy(dtype=np.float64)
+    validi = ~np.isnan(valori)
+    presenti = validi.astype(np.float64)
+    x = centra_validi(valori, validi)
+    
+    n = presenti.T @ presenti
+    somme = x.T @ presenti          # somme[i, j]: somma di x_i sulle date valide anche per j
+    quadrati = (x * x).T @ presenti
+    prodotti = x.T @ x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covarianza = (prodotti - somme * somme.T / n) / (n - 1)
+        varianze_i = (quadrati - somme ** 2 / n) / (n - 1)
+        correlazione = covarianza / np.sqrt(varianze_i * varianze_i.T)
+    pochi = n < MIN_OSSERVAZIONI_CORRELAZIONE
+    covarianza[pochi] = np.nan
+    correlazione[pochi] = np.nan
+    np.clip(correlazione, -1, 1, out=correlazione)
+    
+    colonne = rendimenti.columns
+    return (
+        pd.DataFrame(correlazione, index=colonne, columns=colonne),
+        pd.DataFrame(covarianza * periodi_anno, index=colonne, columns=colonne)
+    )
+
+def correlazioni_panel(panel, finestra, frequenza, cache):
+    """Restituisce (correlazione, covarianza annualizzata) del panel, ricalcolandole solo se servono
+
+    La cache è indicizzata su (selezione, finestra, frequenza) e la voce resta valida finché il
+    panel è lo stesso oggetto (panel_indici lo ricostruisce quando cambiano i dati).
+    """
+    chiave = (tuple(panel.columns), finestra, frequenza)
+    matrici = cerca_in_cache(cache, chiave, [panel])
+    if matrici is not None:
+        return matrici
+    
+    rendimenti = rendimenti_periodici(panel, FREQUENZE_RENDIMENTI[frequenza])
+    anni = FINESTRE_CORRELAZIONE[finestra]
+    if anni is not None and len(rendimenti):
+        rendimenti = rendimenti.loc[rendimenti.index[-1] - pd.DateOffset(years=anni):]
+    matrici = matrici_covarianza(rendimenti, periodi_anno_rendimenti(panel, frequenza))
+    return salva_in_cache(cache, chiave, [panel], matrici)
+
+def periodi_anno_rendimenti(panel, frequenza):
+    """Rendimenti per anno alla frequenza scelta (quella del panel per i rendimenti giornalieri)"""
+    regola = FREQUENZE_RENDIMENTI[frequenza]
+    return PERIODI_ANNO_FREQUENZA[regola] if regola else rileva_periodi_per_anno(panel.index)
+
+def righe_finestra_rendimenti(panel, frequenza, anni):
+    """Numero di rendimenti alla frequenza scelta che coprono la durata in anni"""
+    return max(MIN_OSSERVAZIONI_CORRELAZIONE, int(round(anni * periodi_anno_rendimenti(panel, frequenza))))
+
+def correlazione_mobile(rendimenti, benchmark, finestra):
+    """Correlazione mobile di ogni colonna con il benchmark sulle ultime finestra righe, in O(n)
+
+    Le somme di x, y, x², y² e xy sulla finestra si ottengono come differenze di somme
+    cumulative, quindi ogni passo costa O(1) indipendentemente dalla finestra, e tutte le
+    coppie con il benchmark sono calcolate insieme. Servono almeno metà finestra di date
+    in cui entrambi i rendimenti sono disponibili.
+    """
+    altri = [nome for nome in rendimenti.columns if nome != benchmark]
+    y = rendimenti[altri].to_numpy(dtype=np.float64)
+    x = np.broadcast_to(rendimenti[benchmark].to_numpy(dtype=np.float64)[:, None], y.shape)
+    t, k = y.shape
+    risultato = np.full((t, k), np.nan)
+    if finestra > t or k == 0:
+        return pd.DataFrame(risultato, index=rendimenti.index, columns=altri)
+    
+    # Ogni coppia è centrata sulle medie delle sole date in cui entrambi i rendimenti esistono
+    validi = ~np.isnan(x) & ~np.isnan(y)
+    x = centra_validi(x, validi)
+    y = centra_validi(y, validi)
+    
+    n = somme_mobili(validi, finestra)
+    somma_x, somma_y = somme_mobili(x, finestra), somme_mobili(y, finestra)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covarianza = somme_mobili(x * y, finestra) - somma_x * somma_y / n
+        varianza_x = somme_mobili(x * x, finestra) - somma_x ** 2 / n
+        varianza_y = somme_mobili(y * y, finestra) - somma_y ** 2 / n
+        correlazione = covarianza / np.sqrt(varianza_x * varianza_y)
+    correlazione[n < max(MIN_OSSERVAZIONI_CORRELAZIONE, finestra // 2)] = np.nan
+    # La finestra che termina alla riga i copre le righe (i-finestra, i]
+    risultato[finestra - 1:] = np.clip(correlazione, -1, 1)
+    return pd.DataFrame(risultato, index=rendimenti.index, columns=altri)
+
+# Riduzione dei punti per traccia prima di costruire il grafico (etichetta -> metodo)
+METODI_RIDUZIONE = {
+    "LTTB": "lttb",
+    "Min/Max": "minmax",
+    "Nessuna": None
+}
+PUNTI_PER_TRACCIA = 2000
+# Oltre questo numero di punti totali il grafico passa a WebGL (Scattergl)
+SOGLIA_WEBGL = 100_000
+
+def indici_lttb(x, y, soglia):
+    """Sceglie soglia punti con Largest-Triangle-Three-Buckets, preservando la forma della curva"""
+    n = len(y)
+    if soglia >= n or soglia < 3:
+        return np.arange(n)
+    x = (x - x[0]).astype(np.float64)
+    # soglia - 2 secchi fra il primo e l'ultimo punto, che vengono sempre mantenuti
+    bordi = np.linspace(1, n - 1, soglia - 1).astype(np.int64)
+    # Medie dei secchi successivi (l'ultimo punto per l'ultimo secchio) calcolate tutte insieme
+    inizi_succ = np.append(bordi[1:-1], n - 1)
+    conteggi = np.diff(np.append(inizi_succ, n))
+    medie_x = (np.add.reduceat(x, inizi_succ) / conteggi).tolist()
+    medie_y = (np.add.reduceat(y, inizi_succ) / conteggi).tolist()
+    bordi = bordi.tolist()
+    scelti = np.empty(soglia, dtype=np.int64)
+    scelti[0], scelti[-1] = 0, n - 1
+    a = 0
+    for i in range(soglia - 2):
+        inizio, fine = bordi[i], bordi[i + 1]
+        xa, ya = x[a], y[a]
+        area = np.abs((xa - medie_x[i]) * (y[inizio:fine] - ya) - (xa - x[inizio:fine]) * (medie_y[i] - ya))
+        a = inizio + int(area.argmax())
+        scelti[i + 1] = a
+    return scelti
+
+def indici_minmax(y, soglia):
+    """Mantiene minimo e massimo di ogni secchio (inviluppo), più il primo e l'ultimo punto"""
+    n = len(y)
+    if soglia >= n or soglia < 4:
+        return np.arange(n)
+    dimensione = -(-n // (soglia // 2))
+    righe = -(-n // dimensione)
+    secchi = np.full(righe * dimensione, np.nan)
+    secchi[:n] = y
+    secchi = secchi.reshape(righe, dimensione)
+    scostamenti = np.arange(righe) * dimensione
+    return np.unique(np.concatenate([
+        [0, n - 1],
+        np.nanargmin(secchi, axis=1) + scostamenti,
+        np.nanargmax(secchi, axis=1) + scostamenti
+    ]))
+
+def riduci_serie(date, valori, soglia, metodo):
+    """Rimuove i NaN e riduce una serie a circa soglia punti con il metodo scelto"""
+    validi = ~np.isnan(valori)
+    date, valori = date[validi], valori[validi]
+    if metodo == "lttb":
+        indici = indici_lttb(date.asi8, valori, soglia)
+    elif metodo == "minmax":
+        indici = indici_minmax(valori, soglia)
+    else:
+        return date, valori
+    return date[indici], valori[indici]
+
+def tracce_ridotte(valori, soglia, metodo, soglia_webgl, cache=None, origine=None, parametri=()):
+    """Riduce ogni colonna del frame date × serie e decide se disegnarle con WebGL
+
+    Restituisce la lista (nome, date, valori) delle tracce e True quando i punti totali
+    dopo la riduzione superano soglia_webgl. Con una cache le tracce sono riusate finché
+    origine (il panel da cui valori è calcolato) è lo stesso oggetto e i parametri del
+    grafico non cambiano, così la riduzione non si ripete a ogni interazione con la pagina.
+    """
+    chiave = (parametri, soglia, metodo, soglia_webgl)
+    if cache is not None:
+        risultato = cerca_in_cache(cache, chiave, [origine])
+        if risultato is not None:
+            return risultato
+    
+    matrice = valori.to_numpy(dtype=np.float64)
+    serie = [
+        (nome, *riduci_serie(valori.index, matrice[:, j], soglia, metodo))
+        for j, nome in enumerate(valori.columns)
+    ]
+    risultato = (serie, sum(len(valori_serie) for _, _, valori_serie in serie) > soglia_webgl)
+    
+    if cache is not None:
+        salva_in_cache(cache, chiave, [origine], risultato)
+    return risultato
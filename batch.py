@@ -0,0 +1,92 @@
+"""Elaborazione batch della tabella performance, senza interfaccia Streamlit
+
+Carica tutti i CSV di una cartella in parallelo e scrive la stessa tabella
+mostrata dall'app in formato CSV o Parquet.
+
+Esempio:
+    python batch.py cartella_csv -o risultati.parquet --workers 8
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from analisi import carica_csv, calcola_statistiche, tabella_risultati, formatta_risultati
+
+# File elaborati da ogni worker per volta: le statistiche del gruppo sono calcolate insieme
+FILE_PER_GRUPPO = 50
+
+
+def analizza_gruppo(percorsi, data_riferimento):
+    """Carica un gruppo di file e calcola le loro righe della tabella performance"""
+    dati = {}
+    errori = []
+    for percorso in percorsi:
+        nome_file = os.path.basename(percorso).replace('.csv', '')
+        with open(percorso, 'rb') as file:
+            df, errore = carica_csv(file)
+        if errore:
+            errori.append((nome_file, errore))
+        else:
+            dati[nome_file] = df
+    
+    indici = list(dati)
+    statistiche = calcola_statistiche(dati, indici, data_riferimento) if indici else {}
+    return tabella_risultati(statistiche, indici), errori
+
+
+def scrivi_risultati(df_risultati, percorso):
+    """Scrive la tabella: Parquet con valori numerici, CSV nello stesso formato del download dell'app"""
+    if percorso.lower().endswith('.parquet'):
+        df_risultati.to_parquet(percorso, index=False)
+    else:
+        formatta_risultati(df_risultati).to_csv(percorso, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calcola la tabella performance per una cartella di file CSV")
+    parser.add_argument('cartella', help="Cartella con i file CSV degli indici")
+    parser.add_argument('-o', '--output', default='analisi_performance.csv', help="File di output (.csv o .parquet)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Numero di processi (default: CPU disponibili)")
+    parser.add_argument('--gruppo', type=int, default=FILE_PER_GRUPPO, help="File elaborati da ogni worker per volta")
+    parser.add_argument('--data', help="Data di riferimento AAAA-MM-GG per gli orizzonti (default: oggi)")
+    args = parser.parse_args(argv)
+    
+    percorsi = sorted(glob.glob(os.path.join(args.cartella, '*.csv')))
+    if not percorsi:
+        print(f"Nessun file CSV trovato in {args.cartella}", file=sys.stderr)
+        return 1
+    
+    if args.data:
+        data_riferimento = datetime.strptime(args.data, '%Y-%m-%d')
+    else:
+        data_riferimento = datetime.combine(datetime.now().date(), datetime.min.time())
+    
+    inizio = time.perf_counter()
+    gruppi = [percorsi[i:i + args.gruppo] for i in range(0, len(percorsi), args.gruppo)]
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        esiti = list(pool.map(analizza_gruppo, gruppi, [data_riferimento] * len(gruppi)))
+    
+    errori = [errore for _, errori_gruppo in esiti for errore in errori_gruppo]
+    for nome_file, errore in errori:
+        print(f"{nome_file}: {errore}", file=sys.stderr)
+    
+    # I gruppi con soli file non validi producono tabelle vuote: si uniscono solo le altre
+    tabelle = [tabella for tabella, _ in esiti if not tabella.empty]
+    df_risultati = pd.concat(tabelle, ignore_index=True) if tabelle else esiti[0][0]
+    scrivi_risultati(df_risultati, args.output)
+    
+    print(
+        f"{len(df_risultati)} indici analizzati, {len(errori)} errori "
+        f"in {time.perf_counter() - inizio:.1f}s -> {args.output}"
+    )
+    return 0 if len(df_risultati) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
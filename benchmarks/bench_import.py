@@ -0,0 +1,47 @@
+"""Benchmark del tempo di import dei moduli dell'app
+
+Ogni import viene misurato in un interprete nuovo, così le cache dei moduli non
+falsano il risultato; si riporta il minimo su più ripetizioni.
+
+Uso: python benchmarks/bench_import.py [ripetizioni]
+"""
+import os
+import subprocess
+import sys
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASI = [
+    ('analisi', 'import analisi'),
+    ('grafici', 'import grafici'),
+    ('batch', 'import batch'),
+    ('analisi + grafici', 'import analisi, grafici'),
+    # Gli import che main.py eseguiva tutti all'avvio prima della separazione dei moduli
+    ('import eager', 'import streamlit, pandas, numpy, plotly.express, plotly.graph_objects, pyarrow.feather'),
+    ('prima figura', 'import grafici, pandas; grafici.figura_barre_performance('
+                     'pandas.DataFrame({"Indice": ["A"], "Performance": [1.0]}), "t")'),
+]
+
+
+def tempo_import(codice):
+    """Secondi impiegati da un interprete nuovo per eseguire il codice"""
+    script = (
+        'import time; inizio = time.perf_counter()\n'
+        f'{codice}\n'
+        'print(time.perf_counter() - inizio)'
+    )
+    uscita = subprocess.run(
+        [sys.executable, '-c', script], cwd=RADICE, capture_output=True, text=True, check=True
+    )
+    return float(uscita.stdout.strip().splitlines()[-1])
+
+
+def main_benchmark(ripetizioni):
+    print(f"{'caso':<20} {'min (s)':>8} {'max (s)':>8}")
+    for nome, codice in CASI:
+        tempi = [tempo_import(codice) for _ in range(ripetizioni)]
+        print(f"{nome:<20} {min(tempi):>8.3f} {max(tempi):>8.3f}")
+
+
+if __name__ == '__main__':
+    main_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
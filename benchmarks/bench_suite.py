@@ -0,0 +1,249 @@
+"""Benchmark dei percorsi critici: parsing dei CSV e calcolo della tabella performance
+
+Genera file sintetici riproducibili (seme fisso) per tre frequenze, con e senza
+l'intestazione di metadati '=== DATI STORICI ===', e misura per ogni fase
+tempo, throughput e picco di memoria (tracemalloc, in un passaggio separato
+per non falsare i tempi).
+
+Uso:
+    python benchmarks/bench_suite.py
+    python benchmarks/bench_suite.py --indici 10 100 1000 10000 --frequenze giornaliero
+    python benchmarks/bench_suite.py --json attuale.json --confronta riferimento.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analisi  # noqa: E402
+
+# Frequenza -> (formato data, righe per indice)
+FREQUENZE = {
+    'mensile': ('%m/%Y', 600),
+    'giornaliero': ('%Y-%m-%d', 2520),
+    'intraday': ('%Y-%m-%d %H:%M:%S', 7800),
+}
+DATA_FINE = datetime(2025, 5, 1)
+# Contenuti distinti generati per scenario: i file successivi li riusano con un altro nome,
+# così anche gli scenari con 10.000 indici restano in memoria
+FILE_DISTINTI = 100
+SEME = 42
+# Rallentamento oltre il quale una fase è segnalata nel confronto con un riferimento
+TOLLERANZA_REGRESSIONE = 1.2
+
+
+def genera_date(frequenza, righe):
+    """Date della serie sintetica, con l'ultima osservazione vicina a DATA_FINE"""
+    if frequenza == 'mensile':
+        return pd.date_range(end=DATA_FINE, periods=righe, freq='MS')
+    if frequenza == 'giornaliero':
+        return pd.date_range(end=DATA_FINE, periods=righe, freq='B')
+    # Barre da 5 minuti nell'orario di contrattazione 9:30-16:00 (78 al giorno)
+    giorni = pd.bdate_range(end=DATA_FINE, periods=-(-righe // 78))
+    minuti = pd.to_timedelta(570 + 5 * np.arange(78), unit='min')
+    return (giorni.repeat(78) + np.tile(minuti, len(giorni)))[-righe:]
+
+
+def genera_csv(nome, date_testo, rng, con_metadata):
+    """Contenuto di un file CSV con un random walk geometrico dei prezzi"""
+    rendimenti = rng.normal(0.0003, 0.01, len(date_testo))
+    prezzi = 100 * np.exp(np.cumsum(rendimenti))
+    if not con_metadata:
+        righe = [f"Date,{nome}"] + [f"{d},{p:.6f}" for d, p in zip(date_testo, prezzi)]
+        return ('\n'.join(righe) + '\n').encode('utf-8')
+
+    # Stesso schema dei file esportati: metadati, marker e quattro colonne senza intestazione
+    perf_pct = (prezzi / prezzi[0] - 1) * 100
+    perf_abs = prezzi - prezzi[0]
+    intestazione = [
+        "=== INFORMAZIONI INDICE ===",
+        f"Nome,{nome}",
+        f"Ticker,{nome.upper().replace(' ', '')}",
+        f"Data Download,{DATA_FINE:%Y-%m-%d}",
+        f"Periodo,{date_testo[0]} - {date_testo[-1]}",
+        f"Numero osservazioni,{len(date_testo)}",
+        f"Performance totale,{perf_pct[-1]:.2f}%",
+        f"Prezzo finale,{prezzi[-1]:.2f}",
+        f"Deviazione standard,{np.std(rendimenti):.6f}",
+        "",
+        analisi.MARKER_DATI_STORICI,
+    ]
+    righe = [
+        f"{d},{p:.6f},{pct:.4f},{ass:.6f}"
+        for d, p, pct, ass in zip(date_testo, prezzi, perf_pct, perf_abs)
+    ]
+    return ('\n'.join(intestazione + righe) + '\n').encode('utf-8')
+
+
+def genera_scenario(frequenza, n_indici, con_metadata, righe=None):
+    """Restituisce la lista (nome, contenuto) dei file sintetici di uno scenario"""
+    formato, righe_default = FREQUENZE[frequenza]
+    date_testo = genera_date(frequenza, righe or righe_default).strftime(formato).tolist()
+    rng = np.random.default_rng(SEME)
+    contenuti = [
+        genera_csv(f"Indice {i}", date_testo, rng, con_metadata)
+        for i in range(min(n_indici, FILE_DISTINTI))
+    ]
+    return [(f"Indice {i}", contenuti[i % len(contenuti)]) for i in range(n_indici)]
+
+
+def fase_parsing(files):
+    dati = {}
+    for nome, contenuto in files:
+        df, errore = analisi.carica_csv(BytesIO(contenuto))
+        if errore:
+            raise RuntimeError(f"{nome}: {errore}")
+        dati[nome] = df
+    return dati
+
+
+def fase_prezzo_per_periodo(dati):
+    # API scalare: una ricerca per indice e orizzonte, come nel vecchio ciclo della tabella
+    for df in dati.values():
+        for giorni in analisi.PERIODI.values():
+            analisi.get_prezzo_per_periodo(df, giorni)
+
+
+def fase_volatilita(dati):
+    for df in dati.values():
+        analisi.calcola_volatilita(df['Price'], analisi.periodi_per_anno(df))
+
+
+def fase_tabella(dati):
+    indici = list(dati)
+    statistiche = analisi.calcola_statistiche(dati, indici, DATA_FINE)
+    return analisi.tabella_risultati(statistiche, indici)
+
+
+# Fasi misurate dopo il parsing: ricevono il dizionario dei DataFrame caricati
+FASI_ANALISI = [
+    ('get_prezzo_per_periodo', fase_prezzo_per_periodo),
+    ('calcola_volatilita', fase_volatilita),
+    ('calcola_orizzonti', lambda dati: analisi.calcola_orizzonti(dati, list(dati), analisi.PERIODI, DATA_FINE)),
+    ('calcola_volatilita_indici', lambda dati: analisi.calcola_volatilita_indici(dati, list(dati))),
+    ('tabella_risultati', fase_tabella),
+]
+
+
+def misura(funzione, ripetizioni):
+    """Tempo minimo su più ripetizioni e picco di memoria di un'esecuzione sotto tracemalloc"""
+    tempi = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        risultato = funzione()
+        tempi.append(time.perf_counter() - inizio)
+        del risultato
+    tracemalloc.start()
+    try:
+        funzione()
+        picco = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(tempi), picco
+
+
+def esegui_scenario(frequenza, n_indici, con_metadata, ripetizioni, righe=None):
+    """Misura tutte le fasi di uno scenario e restituisce una riga di risultati per fase"""
+    files = genera_scenario(frequenza, n_indici, con_metadata, righe)
+    byte_totali = sum(len(contenuto) for _, contenuto in files)
+    scenario = {'frequenza': frequenza, 'indici': n_indici, 'metadata': con_metadata}
+
+    secondi, picco = misura(lambda: fase_parsing(files), ripetizioni)
+    dati = fase_parsing(files)
+    righe_totali = sum(len(df) for df in dati.values())
+    risultati = [dict(
+        scenario, fase='carica_csv', secondi=secondi, ms_per_indice=secondi / n_indici * 1000,
+        righe_al_secondo=righe_totali / secondi, mb_al_secondo=byte_totali / secondi / 2**20,
+        picco_mb=picco / 2**20
+    )]
+
+    for nome_fase, funzione in FASI_ANALISI:
+        secondi, picco = misura(lambda: funzione(dati), ripetizioni)
+        risultati.append(dict(
+            scenario, fase=nome_fase, secondi=secondi, ms_per_indice=secondi / n_indici * 1000,
+            righe_al_secondo=righe_totali / secondi, mb_al_secondo=None, picco_mb=picco / 2**20
+        ))
+    return risultati
+
+
+def chiave_risultato(riga):
+    return (riga['frequenza'], riga['indici'], riga['metadata'], riga['fase'])
+
+
+def stampa_risultati(risultati, riferimento=None):
+    """Stampa la tabella dei risultati, con il rapporto rispetto al riferimento se presente"""
+    intestazione = (
+        f"{'frequenza':<12} {'indici':>6} {'meta':>5} {'fase':<26} {'tempo (s)':>10} "
+        f"{'ms/indice':>10} {'righe/s':>12} {'MB/s':>7} {'picco MB':>9}"
+    )
+    if riferimento:
+        intestazione += f" {'vs rif.':>8}"
+    print(intestazione)
+    regressioni = []
+    for riga in risultati:
+        mb_s = f"{riga['mb_al_secondo']:.1f}" if riga['mb_al_secondo'] is not None else '-'
+        testo = (
+            f"{riga['frequenza']:<12} {riga['indici']:>6} {'si' if riga['metadata'] else 'no':>5} "
+            f"{riga['fase']:<26} {riga['secondi']:>10.4f} {riga['ms_per_indice']:>10.3f} "
+            f"{riga['righe_al_secondo']:>12,.0f} {mb_s:>7} {riga['picco_mb']:>9.1f}"
+        )
+        precedente = (riferimento or {}).get(chiave_risultato(riga))
+        if precedente:
+            rapporto = riga['secondi'] / precedente['secondi']
+            testo += f" {rapporto:>7.2f}x"
+            if rapporto > TOLLERANZA_REGRESSIONE:
+                testo += "  REGRESSIONE"
+                regressioni.append(riga)
+        print(testo)
+    return regressioni
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di parsing e analisi su dati sintetici")
+    parser.add_argument('--frequenze', nargs='+', choices=list(FREQUENZE), default=list(FREQUENZE))
+    parser.add_argument('--indici', nargs='+', type=int, default=[10, 100, 1000],
+                        help="Numero di indici per scenario (fino a 10000)")
+    parser.add_argument('--metadata', choices=['si', 'no', 'entrambi'], default='entrambi',
+                        help="File con o senza l'intestazione di metadati")
+    parser.add_argument('--righe', type=int, help="Righe per indice (default: dipende dalla frequenza)")
+    parser.add_argument('--ripetizioni', type=int, default=3)
+    parser.add_argument('--json', help="Salva i risultati in un file JSON")
+    parser.add_argument('--confronta', help="File JSON di riferimento: segnala le fasi più lente")
+    args = parser.parse_args(argv)
+
+    varianti_metadata = {'si': [True], 'no': [False], 'entrambi': [False, True]}[args.metadata]
+    risultati = []
+    for frequenza in args.frequenze:
+        for n_indici in args.indici:
+            for con_metadata in varianti_metadata:
+                risultati.extend(esegui_scenario(frequenza, n_indici, con_metadata, args.ripetizioni, args.righe))
+
+    riferimento = None
+    if args.confronta:
+        with open(args.confronta, encoding='utf-8') as f:
+            riferimento = {chiave_risultato(riga): riga for riga in json.load(f)['risultati']}
+    regressioni = stampa_risultati(risultati, riferimento)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'data': datetime.now().isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'pandas': pd.__version__,
+                'numpy': np.__version__,
+                'risultati': risultati
+            }, f, indent=2)
+
+    return 1 if regressioni else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Strumentazione opzionale dell'app: tempi e memoria delle singole fasi
+
+Le misure restano nella sessione e si possono esportare in JSON, così una sessione
+lenta si può analizzare senza collegare profiler esterni.
+"""
+import json
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Misure conservate per sessione: oltre questo numero si scartano le più vecchie
+MAX_MISURE = 500
+# Righe di codice con la maggiore crescita di memoria riportate per ogni fase
+RIGHE_ALLOCAZIONI = 3
+
+class Diagnostica:
+    """Raccoglie tempo, picco e variazione di memoria delle fasi eseguite
+
+    La memoria è misurata con tracemalloc, che è globale al processo: con più sessioni
+    aperte contemporaneamente i picchi includono anche le loro allocazioni.
+    """
+
+    def __init__(self, max_misure=MAX_MISURE):
+        self.attiva = False
+        self.traccia_avviata = False
+        self.misure = deque(maxlen=max_misure)
+
+    def imposta(self, attiva):
+        """Attiva o disattiva la raccolta, avviando tracemalloc se non è già attivo"""
+        if attiva and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.traccia_avviata = True
+        elif not attiva and self.traccia_avviata:
+            # Si ferma solo il tracciamento avviato da questa sessione
+            tracemalloc.stop()
+            self.traccia_avviata = False
+        self.attiva = attiva
+
+    def registra(self, fase, secondi, **dettagli):
+        """Aggiunge una misura già calcolata (es. i tempi dei file caricati in parallelo)"""
+        if self.attiva:
+            self.misure.append({
+                'fase': fase,
+                'istante': datetime.now().isoformat(timespec='milliseconds'),
+                'secondi': secondi,
+                **dettagli
+            })
+
+    @contextmanager
+    def fase(self, nome, **dettagli):
+        """Misura il blocco racchiuso; senza diagnostica attiva non fa nulla"""
+        if not self.attiva:
+            yield
+            return
+        traccia = tracemalloc.is_tracing()
+        if traccia:
+            snapshot_inizio = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            memoria_inizio = tracemalloc.get_traced_memory()[0]
+        inizio = time.perf_counter()
+        try:
+            yield
+        finally:
+            secondi = time.perf_counter() - inizio
+            if traccia and tracemalloc.is_tracing():
+                corrente, picco = tracemalloc.get_traced_memory()
+                differenze = tracemalloc.take_snapshot().compare_to(snapshot_inizio, 'lineno')
+                dettagli.update(
+                    picco_mb=(picco - memoria_inizio) / 2**20,
+                    delta_mb=(corrente - memoria_inizio) / 2**20,
+                    allocazioni=[
+                        f"{d.traceback[0].filename}:{d.traceback[0].lineno} {d.size_diff / 2**20:+.2f} MB"
+                        for d in differenze[:RIGHE_ALLOCAZIONI]
+                    ]
+                )
+            self.registra(nome, secondi, **dettagli)
+
+    def riepilogo(self):
+        """Aggrega le misure per fase: esecuzioni, tempo ultimo/medio/massimo e picco di memoria"""
+        fasi = {}
+        for misura in self.misure:
+            fasi.setdefault(misura['fase'], []).append(misura)
+        righe = []
+        for fase, misure in fasi.items():
+            tempi = [m['secondi'] for m in misure]
+            picchi = [m['picco_mb'] for m in misure if 'picco_mb' in m]
+            righe.append({
+                'fase': fase,
+                'esecuzioni': len(misure),
+                'ultimo_ms': tempi[-1] * 1000,
+                'medio_ms': sum(tempi) / len(tempi) * 1000,
+                'max_ms': max(tempi) * 1000,
+                'picco_mb': max(picchi) if picchi else None
+            })
+        return righe
+
+    def esporta_json(self):
+        """Riepilogo e misure singole in formato JSON"""
+        return json.dumps({
+            'generato': datetime.now().isoformat(timespec='seconds'),
+            'tracemalloc': tracemalloc.is_tracing(),
+            'riepilogo': self.riepilogo(),
+            'misure': list(self.misure)
+        }, indent=2, default=str)
+
+    def svuota(self):
+        self.misure.clear()
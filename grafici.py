@@ -0,0 +1,134 @@
+"""Costruzione delle figure Plotly dell'app
+
+Plotly viene importato solo alla prima figura richiesta: il modulo può essere
+importato da processi headless o dai benchmark senza pagarne il costo.
+"""
+import numpy as np
+
+
+def crea_traccia_linea(nome, date, valori, etichetta, webgl=False):
+    """Crea la traccia di una serie, con Scattergl e payload compatto in modalità WebGL
+
+    In WebGL le date viaggiano come millisecondi (float64) e i valori come float32:
+    entrambi vengono serializzati in base64 invece che come liste di stringhe e numeri.
+    """
+    import plotly.graph_objects as go
+    
+    hovertemplate = f'{nome}<br>Data: %{{x}}<br>{etichetta}: %{{y:.2f}}<extra></extra>'
+    if webgl:
+        return go.Scattergl(
+            x=date.to_numpy(dtype='datetime64[ms]').astype(np.int64).astype(np.float64),
+            y=np.asarray(valori, dtype=np.float32),
+            mode='lines',
+            name=nome,
+            hovertemplate=hovertemplate
+        )
+    return go.Scatter(x=date, y=valori, mode='lines', name=nome, hovertemplate=hovertemplate)
+
+
+def figura_linee(serie, etichetta, titolo, titolo_asse_y, webgl=False):
+    """Grafico a linee nel tempo; serie è una lista di (nome, date, valori)"""
+    import plotly.graph_objects as go
+    
+    fig = go.Figure(data=[
+        crea_traccia_linea(nome_indice, date_serie, valori_serie, etichetta, webgl)
+        for nome_indice, date_serie, valori_serie in serie
+    ])
+    if webgl:
+        fig.update_xaxes(type='date')
+    
+    fig.update_layout(
+        title=titolo,
+        xaxis_title="Data",
+        yaxis_title=titolo_asse_y,
+        height=600,
+        hovermode='x unified'
+    )
+    return fig
+
+
+def figura_serie_storica(serie, etichetta, normalizza, webgl=False):
+    """Grafico a linee delle serie storiche; serie è una lista di (nome, date, valori)"""
+    titolo_asse_y = "Valore Normalizzato (Base 100)" if normalizza else "Prezzo"
+    return figura_linee(serie, etichetta, "Serie Storica degli Indici", titolo_asse_y, webgl)
+
+
+def figura_metrica_mobile(serie, metrica, finestra, webgl=False):
+    """Grafico a linee di una metrica mobile (etichetta di METRICHE_MOBILI) su una finestra"""
+    fig = figura_linee(serie, "Valore", f"{metrica} - finestra {finestra}", metrica, webgl)
+    fig.add_hline(y=0, line_width=1, line_color="gray")
+    return fig
+
+
+def figura_correlazione_mobile(serie, benchmark, finestra, webgl=False):
+    """Grafico a linee della correlazione mobile di ogni indice con il benchmark"""
+    fig = figura_linee(
+        serie, "Correlazione", f"Correlazione mobile con {benchmark} - finestra {finestra}", "Correlazione", webgl
+    )
+    fig.update_yaxes(range=[-1, 1])
+    fig.add_hline(y=0, line_width=1, line_color="gray")
+    return fig
+
+
+def figura_heatmap(matrice, titolo, scala_simmetrica=True):
+    """Heatmap di una matrice quadrata indice × indice (correlazioni o covarianze)"""
+    import plotly.graph_objects as go
+    
+    valori = matrice.to_numpy()
+    estremo = np.nanmax(np.abs(valori)) if scala_simmetrica and np.isfinite(valori).any() else None
+    # Con molti indici le etichette nelle celle diventerebbero illeggibili
+    mostra_valori = len(matrice) <= 20
+    fig = go.Figure(go.Heatmap(
+        z=valori,
+        x=list(matrice.columns),
+        y=list(matrice.index),
+        zmin=-estremo if estremo else None,
+        zmax=estremo if estremo else None,
+        colorscale="RdBu_r",
+        text=np.round(valori, 2) if mostra_valori else None,
+        texttemplate="%{text}" if mostra_valori else None,
+        hovertemplate="%{y} / %{x}: %{z:.4f}<extra></extra>"
+    ))
+    
+    fig.update_layout(
+        title=titolo,
+        height=max(500, min(1200, 25 * len(matrice))),
+        yaxis_autorange="reversed"
+    )
+    return fig
+
+
+def figura_barre_performance(perf_df, titolo):
+    """Barre orizzontali della performance per indice, ordinate dalla peggiore alla migliore"""
+    import plotly.express as px
+    
+    fig = px.bar(
+        perf_df.sort_values("Performance", ascending=True),
+        x="Performance",
+        y="Indice",
+        orientation="h",
+        title=titolo,
+        color="Performance",
+        color_continuous_scale="RdYlGn"
+    )
+    
+    fig.update_layout(height=400)
+    return fig
+
+
+def figura_confronto_periodi(confronto_df):
+    """Barre raggruppate della performance di ogni indice sui diversi periodi"""
+    import plotly.express as px
+    
+    fig = px.bar(
+        confronto_df,
+        x="Indice",
+        y="Performance",
+        color="Periodo",
+        barmode="group",
+        title="Confronto Performance per Periodi",
+        labels={"Performance": "Performance (%)"}
+    )
+    
+    fig.update_layout(height=500)
+    return fig
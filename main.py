@@ -1,13 +1,63 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
-from io import StringIO
+from datetime import datetime
+from collections import OrderedDict
+import os
 import warnings
 warnings.filterwarnings('ignore')
 
+from analisi import (
+    CacheParsing,
+    ArchivioLocale,
+    archivio_disponibile,
+    CARTELLA_ARCHIVIO,
+    carica_files_in_parallelo,
+    MODALITA_MEMORIA,
+    TOLLERANZA_FLOAT32,
+    statistiche_indici,
+    tabella_risultati,
+    COLONNE_PERCENTUALI,
+    COLONNE_GIORNI,
+    formatta_risultati,
+    ALLINEAMENTI,
+    panel_indici,
+    ribasa_a_100,
+    METODI_RIDUZIONE,
+    PUNTI_PER_TRACCIA,
+    SOGLIA_WEBGL,
+    tracce_ridotte,
+    METRICHE_MOBILI,
+    FINESTRE_MOBILI,
+    righe_per_finestra,
+    periodi_per_anno,
+    calcola_metrica_mobile,
+    FREQUENZE_RENDIMENTI,
+    FINESTRE_CORRELAZIONE,
+    correlazioni_panel,
+    rendimenti_periodici,
+    righe_finestra_rendimenti,
+    correlazione_mobile,
+    calcola_statistiche
+)
+from grafici import (
+    figura_linee,
+    figura_serie_storica,
+    figura_metrica_mobile,
+    figura_heatmap,
+    figura_correlazione_mobile,
+    figura_barre_performance,
+    figura_confronto_periodi
+)
+from diagnostica import Diagnostica
+from portafoglio import (
+    RIBILANCIAMENTI,
+    SOGLIA_RIBILANCIAMENTO,
+    COSTO_TRANSAZIONE_BPS,
+    prezzi_portafoglio,
+    backtest_portafoglio,
+    serie_portafoglio
+)
+
 # Configurazione pagina
 st.set_page_config(
     page_title="Portfolio Tracker & Analyzer - CSV Edition",
@@ -26,6 +76,18 @@ if 'dati_caricati' not in st.session_state:
     st.session_state.dati_caricati = {}
 if 'ultima_analisi' not in st.session_state:
     st.session_state.ultima_analisi = None
+if 'chiave_analisi' not in st.session_state:
+    st.session_state.chiave_analisi = None
+if 'statistiche_indici' not in st.session_state:
+    st.session_state.statistiche_indici = {}
+if 'cache_panel' not in st.session_state:
+    st.session_state.cache_panel = OrderedDict()
+if 'cache_correlazioni' not in st.session_state:
+    st.session_state.cache_correlazioni = OrderedDict()
+if 'cache_tracce' not in st.session_state:
+    st.session_state.cache_tracce = OrderedDict()
+if 'diagnostica' not in st.session_state:
+    st.session_state.diagnostica = Diagnostica()
 
 # Sidebar per caricamento file
 st.sidebar.header("📂 Caricamento File CSV")
@@ -41,87 +103,47 @@ uploaded_files = st.sidebar.file_uploader(
     help="Puoi caricare più file contemporaneamente"
 )
 
-def pulisci_nome_colonna(nome):
-    """Pulisce il nome della colonna rimuovendo caratteri speciali"""
-    return nome.strip().replace('\n', ' ').replace('\r', '')
+if 'cache_parsing' not in st.session_state:
+    st.session_state.cache_parsing = CacheParsing()
 
-def carica_csv(file):
-    """Carica e valida un file CSV"""
-    try:
-        # Leggi il contenuto del file come stringa
-        content = file.read().decode('utf-8')
-        lines = content.split('\n')
-        
-        # Trova l'inizio dei dati storici
-        data_start_index = -1
-        for i, line in enumerate(lines):
-            if '=== DATI STORICI ===' in line:
-                data_start_index = i + 1
-                break
-            # Se non troviamo il marker, cerchiamo la prima riga con formato data
-            elif line.strip() and not line.startswith('===') and not line.startswith('Nome') and not line.startswith('Ticker') and not line.startswith('Data Download') and not line.startswith('Periodo') and not line.startswith('Numero') and not line.startswith('Performance') and not line.startswith('Prezzo') and not line.startswith('Deviazione') and ',' in line:
-                # Controlla se sembra una riga di dati (inizia con una data)
-                first_part = line.split(',')[0].strip()
-                if first_part and (first_part.replace('-', '').replace('/', '').isdigit() or '/' in first_part or '-' in first_part):
-                    data_start_index = i
-                    break
-        
-        if data_start_index == -1:
-            # Fallback: prova a leggere come CSV normale
-            df = pd.read_csv(StringIO(content))
-        else:
-            # Estrai solo le righe dei dati
-            data_lines = lines[data_start_index:]
-            
-            # Rimuovi righe vuote
-            data_lines = [line for line in data_lines if line.strip()]
-            
-            if not data_lines:
-                return None, "Nessun dato trovato nel file"
-            
-            # Crea un nuovo CSV string con solo i dati
-            csv_content = '\n'.join(data_lines)
-            
-            # Leggi come DataFrame
-            df = pd.read_csv(StringIO(csv_content), header=None)
-        
-        # Pulisci i nomi delle colonne se presenti
-        if hasattr(df.columns, 'str'):
-            df.columns = [pulisci_nome_colonna(str(col)) for col in df.columns]
-        
-        # Verifica che abbia almeno 2 colonne
-        if len(df.columns) < 2:
-            return None, "Il file deve avere almeno 2 colonne (Data e Prezzo)"
-        
-        # Se il DataFrame non ha header, assegna nomi basati sul numero di colonne
-        if df.columns[0] == 0:  # Significa che non c'erano header
-            if len(df.columns) >= 4:
-                df.columns = ['Date', 'Price', 'Performance_PCT', 'Performance_ABS'] + [f'Col_{i}' for i in range(4, len(df.columns))]
-            else:
-                df.columns = ['Date', 'Price'] + [f'Col_{i}' for i in range(2, len(df.columns))]
-        else:
-            # Rinomina le prime due colonne
-            df.columns = ['Date', 'Price'] + list(df.columns[2:])
-        
-        # Converti la colonna Date
-        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-        
-        # Converti la colonna Price in numerico
-        df['Price'] = pd.to_numeric(df['Price'], errors='coerce')
-        
-        # Rimuovi righe con valori mancanti nelle colonne essenziali
-        df = df.dropna(subset=['Date', 'Price'])
-        
-        # Ordina per data
-        df = df.sort_values('Date').reset_index(drop=True)
-        
-        if len(df) < 2:
-            return None, "Il file deve contenere almeno 2 righe valide"
-        
-        return df, None
-        
-    except Exception as e:
-        return None, f"Errore nel caricamento: {str(e)}"
+# Forma in cui le serie restano in memoria: le modalità compatte tengono solo Date e Price
+modalita_memoria = st.sidebar.selectbox(
+    "🧮 Memoria serie",
+    list(MODALITA_MEMORIA),
+    help="Le serie compatte occupano meno memoria; si applica ai file caricati da ora in poi"
+)
+compattazione = MODALITA_MEMORIA[modalita_memoria]
+if compattazione is not None and compattazione.get('prezzi_float32'):
+    compattazione = dict(compattazione, tolleranza=st.sidebar.number_input(
+        "Tolleranza float32 (errore relativo)",
+        min_value=0.0,
+        max_value=1e-2,
+        value=TOLLERANZA_FLOAT32,
+        format="%.1e",
+        help="I prezzi restano float64 se la conversione supera questo errore relativo"
+    ))
+
+# Archivio locale opzionale: ripristina le serie salvate all'avvio della sessione
+archivio = None
+if archivio_disponibile():
+    usa_archivio = st.sidebar.checkbox(
+        "💾 Archivio locale",
+        value=os.path.exists(os.path.join(CARTELLA_ARCHIVIO, 'manifest.json')),
+        help=f"Salva le serie caricate in '{CARTELLA_ARCHIVIO}' e le ripristina all'avvio"
+    )
+    if usa_archivio:
+        archivio = ArchivioLocale()
+        if 'archivio_ripristinato' not in st.session_state:
+            st.session_state.archivio_ripristinato = True
+            st.session_state.dati_caricati.update(archivio.carica_tutti())
+
+# Diagnostica opzionale: tempi e memoria delle fasi, mostrati in fondo alla sidebar
+diagnostica = st.session_state.diagnostica
+diagnostica.imposta(st.sidebar.checkbox(
+    "🩺 Diagnostica",
+    value=False,
+    help="Misura tempo e memoria (tracemalloc) di caricamento, statistiche, grafici e riepilogo"
+))
 
 # Caricamento e validazione dei file
 if uploaded_files:
@@ -130,10 +152,17 @@ if uploaded_files:
     nuovi_dati = {}
     errori = []
     
-    for file in uploaded_files:
-        nome_file = file.name.replace('.csv', '')
-        df, errore = carica_csv(file)
-        
+    with diagnostica.fase("Caricamento file", file=len(uploaded_files)):
+        caricati = carica_files_in_parallelo(
+            uploaded_files,
+            st.session_state.cache_parsing,
+            archivio,
+            dati_esistenti=st.session_state.dati_caricati,
+            compattazione=compattazione
+        )
+    
+    for nome_file, df, errore, secondi, origine in caricati:
+        diagnostica.registra("carica_csv", secondi, file=nome_file, origine=origine)
         if errore:
             errori.append(f"**{nome_file}**: {errore}")
         else:
@@ -161,39 +190,25 @@ if uploaded_files:
                 'Data Inizio': df['Date'].min().strftime('%Y-%m-%d'),
                 'Data Fine': df['Date'].max().strftime('%Y-%m-%d'),
                 'Prezzo Minimo': f"{df['Price'].min():.2f}",
-                'Prezzo Massimo': f"{df['Price'].max():.2f}"
+                'Prezzo Massimo': f"{df['Price'].max():.2f}",
+                'Memoria (KB)': f"{df.memory_usage(deep=True).sum() / 1024:.1f}"
             })
         
         summary_df = pd.DataFrame(summary_data)
         st.dataframe(summary_df, use_container_width=True)
+    
+    # Tempi di caricamento per file
+    with st.expander("⏱️ Tempi di caricamento"):
+        tempi_df = pd.DataFrame(
+            [(nome_file, origine, secondi * 1000) for nome_file, _, _, secondi, origine in caricati],
+            columns=['File', 'Origine', 'Tempo (ms)']
+        )
+        st.dataframe(
+            tempi_df,
+            use_container_width=True,
+            column_config={'Tempo (ms)': st.column_config.NumberColumn(format="%.1f")}
+        )
 
-# Funzioni per calcolare performance
-def calcola_performance(prezzo_inizio, prezzo_fine):
-    """Calcola la performance percentuale"""
-    if pd.isna(prezzo_inizio) or pd.isna(prezzo_fine) or prezzo_inizio == 0:
-        return np.nan
-    return ((prezzo_fine - prezzo_inizio) / prezzo_inizio) * 100
-
-def calcola_rendimento_annualizzato(prezzo_inizio, prezzo_fine, anni):
-    """Calcola il rendimento medio annuo"""
-    if pd.isna(prezzo_inizio) or pd.isna(prezzo_fine) or prezzo_inizio == 0 or anni <= 0:
-        return np.nan
-    return (((prezzo_fine / prezzo_inizio) ** (1/anni)) - 1) * 100
-
-def calcola_volatilita(prezzi):
-    """Calcola la volatilità annualizzata"""
-    if len(prezzi) < 2:
-        return np.nan
-    rendimenti = prezzi.pct_change().dropna()
-    return rendimenti.std() * np.sqrt(252) * 100  # Assumendo 252 giorni di trading
-
-def get_prezzo_per_periodo(df, giorni_fa):
-    """Ottiene il prezzo più vicino a X giorni fa"""
-    data_target = datetime.now() - timedelta(days=giorni_fa)
-    df_copy = df.copy()
-    df_copy['diff'] = abs((df_copy['Date'] - data_target).dt.days)
-    idx = df_copy['diff'].idxmin()
-    return df_copy.loc[idx, 'Price'], df_copy.loc[idx, 'Date']
 
 # Analisi Performance
 if st.session_state.dati_caricati:
@@ -208,253 +223,384 @@ if st.session_state.dati_caricati:
     )
     
     if indici_selezionati:
-        # Calcola performance
-        risultati = []
-        
-        for nome_indice in indici_selezionati:
-            df = st.session_state.dati_caricati[nome_indice]
-            prezzo_attuale = df['Price'].iloc[-1]
-            data_attuale = df['Date'].iloc[-1]
-            
-            riga = {"Indice": nome_indice}
-            
-            # Performance per diversi periodi
-            periodi = {
-                "1M": 30,
-                "3M": 90,
-                "6M": 180,
-                "1A": 365,
-                "3A": 1095,
-                "5A": 1825
-            }
-            
-            for periodo_nome, giorni in periodi.items():
-                try:
-                    prezzo_inizio, data_inizio = get_prezzo_per_periodo(df, giorni)
-                    performance = calcola_performance(prezzo_inizio, prezzo_attuale)
-                    riga[f"Performance {periodo_nome}"] = f"{performance:.2f}%" if not pd.isna(performance) else "N/A"
-                except:
-                    riga[f"Performance {periodo_nome}"] = "N/A"
-            
-            # Rendimenti annualizzati
-            try:
-                prezzo_5a, _ = get_prezzo_per_periodo(df, 1825)
-                rend_5a = calcola_rendimento_annualizzato(prezzo_5a, prezzo_attuale, 5)
-                riga["Rend. Medio 5A (%)"] = f"{rend_5a:.2f}%" if not pd.isna(rend_5a) else "N/A"
-            except:
-                riga["Rend. Medio 5A (%)"] = "N/A"
-            
-            # Volatilità annualizzata
-            try:
-                volatilita = calcola_volatilita(df['Price'])
-                riga["Volatilità (%)"] = f"{volatilita:.2f}%" if not pd.isna(volatilita) else "N/A"
-            except:
-                riga["Volatilità (%)"] = "N/A"
-            
-            # Informazioni aggiuntive
-            riga["Prezzo Attuale"] = f"{prezzo_attuale:.2f}"
-            riga["Data Ultimo"] = data_attuale.strftime('%Y-%m-%d')
+        # Statistiche per indice: ricalcolate solo se il DataFrame è cambiato
+        with diagnostica.fase("Statistiche e tabella"):
+            oggi = datetime.combine(datetime.now().date(), datetime.min.time())
+            statistiche = statistiche_indici(
+                st.session_state.dati_caricati, indici_selezionati, st.session_state.statistiche_indici, oggi
+            )
             
-            risultati.append(riga)
+            # La tabella viene ricostruita solo se cambiano selezione o statistiche
+            chiave_analisi = (list(indici_selezionati), [statistiche[nome] for nome in indici_selezionati])
+            precedente = st.session_state.chiave_analisi
+            tabella_valida = (
+                precedente is not None
+                and st.session_state.ultima_analisi is not None
+                and precedente[0] == chiave_analisi[0]
+                and all(a is b for a, b in zip(precedente[1], chiave_analisi[1]))
+            )
+            if not tabella_valida:
+                # Salva risultati in session state (valori numerici, formattati solo in output)
+                st.session_state.ultima_analisi = tabella_risultati(statistiche, indici_selezionati)
+                st.session_state.chiave_analisi = chiave_analisi
         
         # Mostra tabella risultati
-        df_risultati = pd.DataFrame(risultati)
+        df_risultati = st.session_state.ultima_analisi
         st.subheader("📊 Tabella Performance")
-        st.dataframe(df_risultati, use_container_width=True, height=400)
-        
-        # Salva risultati in session state
-        st.session_state.ultima_analisi = df_risultati
+        formato_tabella = {
+            **{colonna: st.column_config.NumberColumn(format="%.2f%%") for colonna in COLONNE_PERCENTUALI},
+            **{colonna: st.column_config.NumberColumn(format="%d") for colonna in COLONNE_GIORNI},
+            "Prezzo Attuale": st.column_config.NumberColumn(format="%.2f"),
+            "Data Ultimo": st.column_config.DateColumn(format="YYYY-MM-DD")
+        }
+        st.dataframe(
+            df_risultati,
+            use_container_width=True,
+            height=400,
+            column_config=formato_tabella
+        )
         
         # Grafici
         st.subheader("📈 Grafici Performance")
         
         # Seleziona tipo di grafico
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
         with col1:
             tipo_grafico = st.selectbox(
                 "Tipo di grafico:",
-                ["Serie Storica", "Performance 1 Anno", "Performance YTD", "Confronto Periodi"]
+                ["Serie Storica", "Analisi Mobile", "Correlazione", "Correlazione Mobile", "Performance 1 Anno", "Performance YTD", "Confronto Periodi"]
             )
         
         with col2:
             normalizza = st.checkbox("Normalizza a 100", value=True, help="Normalizza tutti gli indici a 100 al punto di partenza")
+            inizio_comune = st.checkbox(
+                "Partenza comune",
+                value=False,
+                disabled=not normalizza,
+                help="Normalizza tutti gli indici a partire dalla data di inizio più recente"
+            )
         
-        if tipo_grafico == "Serie Storica":
-            # Grafico serie storica
-            fig = go.Figure()
-            
-            for nome_indice in indici_selezionati:
-                df = st.session_state.dati_caricati[nome_indice]
-                
+        with col3:
+            allineamento = ALLINEAMENTI[st.selectbox(
+                "Allineamento date:",
+                list(ALLINEAMENTI),
+                help="Come allineare le date di indici con calendari o frequenze diverse"
+            )]
+        
+        # Prezzi di tutti gli indici selezionati su un asse di date comune
+        with diagnostica.fase("Panel indici"):
+            panel = panel_indici(
+                st.session_state.dati_caricati, indici_selezionati, allineamento, st.session_state.cache_panel
+            )
+        
+        with diagnostica.fase(f"Grafico {tipo_grafico}"):
+            if panel.empty and tipo_grafico in ("Serie Storica", "Analisi Mobile", "Correlazione", "Correlazione Mobile"):
+                st.warning("Nessuna data comune fra gli indici selezionati: scegli un altro allineamento delle date")
+            elif tipo_grafico == "Serie Storica":
+                # Grafico serie storica: tutte le curve dalla stessa matrice di prezzi
                 if normalizza:
                     # Normalizza a 100
-                    prezzi_norm = (df['Price'] / df['Price'].iloc[0]) * 100
-                    fig.add_trace(go.Scatter(
-                        x=df['Date'],
-                        y=prezzi_norm,
-                        mode='lines',
-                        name=nome_indice,
-                        hovertemplate=f'{nome_indice}<br>Data: %{{x}}<br>Valore: %{{y:.2f}}<extra></extra>'
-                    ))
+                    valori = ribasa_a_100(panel, inizio_comune)
+                    etichetta = "Valore"
                 else:
-                    fig.add_trace(go.Scatter(
-                        x=df['Date'],
-                        y=df['Price'],
-                        mode='lines',
-                        name=nome_indice,
-                        hovertemplate=f'{nome_indice}<br>Data: %{{x}}<br>Prezzo: %{{y:.2f}}<extra></extra>'
-                    ))
+                    valori = panel
+                    etichetta = "Prezzo"
+                
+                with st.expander("⚙️ Opzioni visualizzazione"):
+                    col_metodo, col_punti = st.columns(2)
+                    with col_metodo:
+                        metodo_riduzione = METODI_RIDUZIONE[st.selectbox(
+                            "Riduzione punti:",
+                            list(METODI_RIDUZIONE),
+                            help="LTTB conserva la forma della curva, Min/Max l'inviluppo di ogni intervallo"
+                        )]
+                    with col_punti:
+                        punti_per_traccia = st.number_input(
+                            "Punti per serie:", min_value=100, max_value=50_000, value=PUNTI_PER_TRACCIA, step=100
+                        )
+                    soglia_webgl = st.number_input(
+                        "Soglia WebGL (punti totali):",
+                        min_value=0,
+                        value=SOGLIA_WEBGL,
+                        step=10_000,
+                        help="Oltre questa soglia il grafico usa il rendering WebGL, più veloce con molte serie"
+                    )
+                    
+                    # L'intervallo visualizzato sostituisce lo zoom: la riduzione si rifà sulle sole date visibili
+                    intervallo = (None, None)
+                    if len(valori) > 1:
+                        data_min, data_max = valori.index[0].to_pydatetime(), valori.index[-1].to_pydatetime()
+                        intervallo = st.slider(
+                            "Intervallo visualizzato:",
+                            min_value=data_min,
+                            max_value=data_max,
+                            value=(data_min, data_max),
+                            format="YYYY-MM-DD"
+                        )
+                
+                # Rendering WebGL automatico quando i punti totali superano la soglia
+                # Le tracce ridotte sono riusate finché panel e opzioni del grafico non cambiano
+                serie_ridotte, usa_webgl = tracce_ridotte(
+                    valori.loc[intervallo[0]:intervallo[1]], punti_per_traccia, metodo_riduzione, soglia_webgl,
+                    st.session_state.cache_tracce, panel, (tipo_grafico, normalizza, inizio_comune, intervallo)
+                )
+                fig = figura_serie_storica(serie_ridotte, etichetta, normalizza, usa_webgl)
+                st.plotly_chart(fig, use_container_width=True)
             
-            fig.update_layout(
-                title="Serie Storica degli Indici",
-                xaxis_title="Data",
-                yaxis_title="Valore Normalizzato (Base 100)" if normalizza else "Prezzo",
-                height=600,
-                hovermode='x unified'
-            )
+            elif tipo_grafico == "Analisi Mobile":
+                # Rendimento, volatilità e drawdown su una finestra mobile, per tutti gli indici insieme
+                col_metrica, col_finestra = st.columns(2)
+                with col_metrica:
+                    metrica = st.selectbox("Metrica:", list(METRICHE_MOBILI))
+                with col_finestra:
+                    finestra = st.selectbox("Finestra:", list(FINESTRE_MOBILI), index=2)
+                
+                if len(panel) > 1:
+                    righe_finestra = righe_per_finestra(panel.index, FINESTRE_MOBILI[finestra])
+                    valori = calcola_metrica_mobile(
+                        panel,
+                        METRICHE_MOBILI[metrica],
+                        righe_finestra,
+                        [periodi_per_anno(st.session_state.dati_caricati[nome]) for nome in panel.columns]
+                    )
+                    serie_ridotte, usa_webgl = tracce_ridotte(
+                        valori, PUNTI_PER_TRACCIA, "lttb", SOGLIA_WEBGL,
+                        st.session_state.cache_tracce, panel, (tipo_grafico, metrica, finestra)
+                    )
+                    if any(len(valori_serie) for _, _, valori_serie in serie_ridotte):
+                        fig = figura_metrica_mobile(serie_ridotte, metrica, finestra, usa_webgl)
+                        st.plotly_chart(fig, use_container_width=True)
+                    else:
+                        st.warning(f"Storico insufficiente per una finestra di {finestra}")
+                else:
+                    st.warning("Servono almeno due date per le metriche mobili")
             
-            st.plotly_chart(fig, use_container_width=True)
-        
-        elif tipo_grafico == "Performance 1 Anno":
-            # Estrai performance 1 anno per il grafico
-            perf_data = []
-            for _, row in df_risultati.iterrows():
-                perf_str = row.get("Performance 1A", "N/A")
-                if perf_str != "N/A":
-                    perf_val = float(perf_str.replace("%", ""))
-                    perf_data.append({"Indice": row["Indice"], "Performance": perf_val})
+            elif tipo_grafico == "Correlazione":
+                # Matrice di correlazione o covarianza dei rendimenti periodici degli indici selezionati
+                col_frequenza, col_finestra, col_matrice = st.columns(3)
+                with col_frequenza:
+                    frequenza = st.selectbox(
+                        "Frequenza rendimenti:",
+                        list(FREQUENZE_RENDIMENTI),
+                        index=2,
+                        help="Con indici a frequenze diverse conviene la frequenza più bassa"
+                    )
+                with col_finestra:
+                    finestra = st.selectbox("Periodo:", list(FINESTRE_CORRELAZIONE), index=2)
+                with col_matrice:
+                    tipo_matrice = st.radio("Matrice:", ["Correlazione", "Covarianza annualizzata"], horizontal=True)
+                
+                if len(panel.columns) < 2:
+                    st.warning("Seleziona almeno due indici per la correlazione")
+                else:
+                    correlazione, covarianza = correlazioni_panel(
+                        panel, finestra, frequenza, st.session_state.cache_correlazioni
+                    )
+                    if tipo_matrice == "Correlazione":
+                        fig = figura_heatmap(correlazione, f"Correlazione dei rendimenti ({frequenza.lower()}, {finestra})")
+                    else:
+                        fig = figura_heatmap(covarianza, f"Covarianza annualizzata ({frequenza.lower()}, {finestra})")
+                    st.plotly_chart(fig, use_container_width=True)
             
-            if perf_data:
-                perf_df = pd.DataFrame(perf_data)
-                perf_df = perf_df.sort_values("Performance", ascending=True)
+            elif tipo_grafico == "Correlazione Mobile":
+                # Correlazione su finestra mobile di tutti gli indici con un benchmark
+                col_benchmark, col_frequenza, col_finestra = st.columns(3)
+                with col_benchmark:
+                    benchmark = st.selectbox("Benchmark:", list(panel.columns))
+                with col_frequenza:
+                    frequenza = st.selectbox("Frequenza rendimenti:", list(FREQUENZE_RENDIMENTI), index=2)
+                with col_finestra:
+                    finestra = st.selectbox("Finestra:", list(FINESTRE_MOBILI), index=3)
                 
-                fig = px.bar(
-                    perf_df,
-                    x="Performance",
-                    y="Indice",
-                    orientation="h",
-                    title="Performance 1 Anno (%)",
-                    color="Performance",
-                    color_continuous_scale="RdYlGn"
+                if len(panel.columns) < 2:
+                    st.warning("Seleziona almeno due indici per la correlazione")
+                else:
+                    rendimenti = rendimenti_periodici(panel, FREQUENZE_RENDIMENTI[frequenza])
+                    valori = correlazione_mobile(
+                        rendimenti,
+                        benchmark,
+                        righe_finestra_rendimenti(panel, frequenza, FINESTRE_MOBILI[finestra])
+                    )
+                    serie_ridotte, usa_webgl = tracce_ridotte(
+                        valori, PUNTI_PER_TRACCIA, "lttb", SOGLIA_WEBGL,
+                        st.session_state.cache_tracce, panel, (tipo_grafico, benchmark, frequenza, finestra)
+                    )
+                    if any(len(valori_serie) for _, _, valori_serie in serie_ridotte):
+                        fig = figura_correlazione_mobile(serie_ridotte, benchmark, finestra, usa_webgl)
+                        st.plotly_chart(fig, use_container_width=True)
+                    else:
+                        st.warning(f"Storico comune insufficiente per una finestra di {finestra}")
+            
+            elif tipo_grafico == "Performance 1 Anno":
+                # Estrai performance 1 anno per il grafico
+                perf_data = df_risultati[["Indice", "Performance 1A"]].dropna().rename(
+                    columns={"Performance 1A": "Performance"}
                 )
                 
-                fig.update_layout(height=400)
-                st.plotly_chart(fig, use_container_width=True)
-        
-        elif tipo_grafico == "Performance YTD":
-            # Performance Year to Date
-            perf_data_ytd = []
-            for nome_indice in indici_selezionati:
-                df = st.session_state.dati_caricati[nome_indice]
-                
-                # Trova il prezzo al 1 gennaio dell'anno corrente
-                anno_corrente = datetime.now().year
-                try:
-                    df_anno = df[df['Date'].dt.year == anno_corrente]
-                    if len(df_anno) > 0:
-                        prezzo_inizio_anno = df_anno['Price'].iloc[0]
-                        prezzo_attuale = df['Price'].iloc[-1]
-                        perf_ytd = calcola_performance(prezzo_inizio_anno, prezzo_attuale)
-                        if not pd.isna(perf_ytd):
-                            perf_data_ytd.append({"Indice": nome_indice, "Performance": perf_ytd})
-                except:
-                    continue
+                if not perf_data.empty:
+                    fig = figura_barre_performance(perf_data, "Performance 1 Anno (%)")
+                    st.plotly_chart(fig, use_container_width=True)
             
-            if perf_data_ytd:
-                perf_df_ytd = pd.DataFrame(perf_data_ytd)
-                perf_df_ytd = perf_df_ytd.sort_values("Performance", ascending=True)
+            elif tipo_grafico == "Performance YTD":
+                # Performance Year to Date
+                perf_data_ytd = [
+                    {"Indice": nome_indice, "Performance": statistiche[nome_indice]["perf_ytd"]}
+                    for nome_indice in indici_selezionati
+                    if not pd.isna(statistiche[nome_indice]["perf_ytd"])
+                ]
                 
-                fig = px.bar(
-                    perf_df_ytd,
-                    x="Performance",
-                    y="Indice",
-                    orientation="h",
-                    title="Performance Year to Date (%)",
-                    color="Performance",
-                    color_continuous_scale="RdYlGn"
-                )
+                if perf_data_ytd:
+                    fig = figura_barre_performance(pd.DataFrame(perf_data_ytd), "Performance Year to Date (%)")
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.warning("Nessun dato disponibile per il calcolo YTD")
+            
+            elif tipo_grafico == "Confronto Periodi":
+                # Grafico a barre multiple per confrontare diversi periodi
+                periodi_confronto = ["1M", "3M", "6M", "1A"]
+                confronto_data = df_risultati.melt(
+                    id_vars="Indice",
+                    value_vars=[f"Performance {periodo}" for periodo in periodi_confronto],
+                    var_name="Periodo",
+                    value_name="Performance"
+                ).dropna(subset=["Performance"])
+                confronto_data["Periodo"] = confronto_data["Periodo"].str.replace("Performance ", "", regex=False)
                 
-                fig.update_layout(height=400)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.warning("Nessun dato disponibile per il calcolo YTD")
+                if not confronto_data.empty:
+                    fig = figura_confronto_periodi(confronto_data)
+                    st.plotly_chart(fig, use_container_width=True)
         
-        elif tipo_grafico == "Confronto Periodi":
-            # Grafico a barre multiple per confrontare diversi periodi
-            periodi_confronto = ["1M", "3M", "6M", "1A"]
-            confronto_data = []
+        # Statistiche riassuntive
+        with diagnostica.fase("Statistiche riassuntive"):
+            st.subheader("📊 Statistiche Riassuntive")
             
-            for _, row in df_risultati.iterrows():
-                indice = row["Indice"]
-                for periodo in periodi_confronto:
-                    perf_str = row.get(f"Performance {periodo}", "N/A")
-                    if perf_str != "N/A":
-                        perf_val = float(perf_str.replace("%", ""))
-                        confronto_data.append({
-                            "Indice": indice,
-                            "Periodo": periodo,
-                            "Performance": perf_val
-                        })
+            col1, col2, col3, col4 = st.columns(4)
             
-            if confronto_data:
-                confronto_df = pd.DataFrame(confronto_data)
+            with col1:
+                st.metric("Indici Analizzati", len(indici_selezionati))
+            
+            with col2:
+                # Conta performance positive 1 anno
+                perf_positive = int((df_risultati["Performance 1A"] > 0).sum())
+                st.metric("Performance 1A Positive", f"{perf_positive}/{len(indici_selezionati)}")
+            
+            with col3:
+                # Media performance 1 anno
+                perf_values = df_risultati["Performance 1A"].dropna()
                 
-                fig = px.bar(
-                    confronto_df,
-                    x="Indice",
-                    y="Performance",
-                    color="Periodo",
-                    barmode="group",
-                    title="Confronto Performance per Periodi",
-                    labels={"Performance": "Performance (%)"}
+                if not perf_values.empty:
+                    media_perf = perf_values.mean()
+                    st.metric("Media Performance 1A", f"{media_perf:.2f}%")
+                else:
+                    st.metric("Media Performance 1A", "N/A")
+            
+            with col4:
+                st.metric("Ultimo Aggiornamento", datetime.now().strftime("%d/%m/%Y %H:%M"))
+            
+            # Download risultati
+            if st.button("📥 Scarica Risultati CSV"):
+                csv = formatta_risultati(df_risultati).to_csv(index=False)
+                st.download_button(
+                    label="Scarica CSV",
+                    data=csv,
+                    file_name=f"analisi_performance_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                    mime="text/csv"
                 )
-                
-                fig.update_layout(height=500)
-                st.plotly_chart(fig, use_container_width=True)
-        
-        # Statistiche riassuntive
-        st.subheader("📊 Statistiche Riassuntive")
         
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            st.metric("Indici Analizzati", len(indici_selezionati))
-        
-        with col2:
-            # Conta performance positive 1 anno
-            perf_positive = 0
-            for _, row in df_risultati.iterrows():
-                perf_str = row.get("Performance 1A", "N/A")
-                if perf_str != "N/A" and float(perf_str.replace("%", "")) > 0:
-                    perf_positive += 1
-            st.metric("Performance 1A Positive", f"{perf_positive}/{len(indici_selezionati)}")
-        
-        with col3:
-            # Media performance 1 anno
-            perf_values = []
-            for _, row in df_risultati.iterrows():
-                perf_str = row.get("Performance 1A", "N/A")
-                if perf_str != "N/A":
-                    perf_values.append(float(perf_str.replace("%", "")))
+        # Backtest di un portafoglio composto dagli indici selezionati
+        st.subheader("💼 Backtest Portafoglio")
+        componenti = st.multiselect(
+            "Indici in portafoglio:",
+            indici_selezionati,
+            default=indici_selezionati,
+            key="componenti_portafoglio"
+        )
+        
+        if componenti:
+            col_pesi, col_opzioni = st.columns([2, 1])
+            with col_pesi:
+                # La chiave dipende dalla composizione, così i pesi ripartono uguali quando cambia
+                pesi = st.data_editor(
+                    pd.DataFrame({"Indice": componenti, "Peso (%)": 100 / len(componenti)}),
+                    use_container_width=True,
+                    hide_index=True,
+                    disabled=["Indice"],
+                    column_config={
+                        "Peso (%)": st.column_config.NumberColumn(min_value=0.0, max_value=100.0, step=1.0, format="%.1f")
+                    },
+                    key="pesi_" + "|".join(componenti)
+                )
+            with col_opzioni:
+                ribilanciamento = RIBILANCIAMENTI[st.selectbox(
+                    "Ribilanciamento:",
+                    list(RIBILANCIAMENTI),
+                    index=list(RIBILANCIAMENTI).index("Trimestrale")
+                )]
+                soglia = st.number_input(
+                    "Soglia di scostamento (punti %):",
+                    min_value=0.5,
+                    max_value=50.0,
+                    value=SOGLIA_RIBILANCIAMENTO,
+                    step=0.5,
+                    disabled=ribilanciamento != "soglia",
+                    help="Si ribilancia quando un peso si allontana dal target di più di questa soglia"
+                )
+                costo_bps = st.number_input(
+                    "Costi di transazione (bps):",
+                    min_value=0.0,
+                    max_value=500.0,
+                    value=COSTO_TRANSAZIONE_BPS,
+                    step=1.0,
+                    help="Pagati sul controvalore scambiato, acquisto iniziale compreso"
+                )
             
-            if perf_values:
-                media_perf = np.mean(perf_values)
-                st.metric("Media Performance 1A", f"{media_perf:.2f}%")
-            else:
-                st.metric("Media Performance 1A", "N/A")
-        
-        with col4:
-            st.metric("Ultimo Aggiornamento", datetime.now().strftime("%d/%m/%Y %H:%M"))
-        
-        # Download risultati
-        if st.button("📥 Scarica Risultati CSV"):
-            csv = df_risultati.to_csv(index=False)
-            st.download_button(
-                label="Scarica CSV",
-                data=csv,
-                file_name=f"analisi_performance_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                mime="text/csv"
-            )
+            with diagnostica.fase("Backtest portafoglio", indici=len(componenti)):
+                # Il panel as-of riusa la cache dei grafici; il backtest parte quando tutti gli indici quotano
+                panel_portafoglio = panel_indici(
+                    st.session_state.dati_caricati, componenti, "asof", st.session_state.cache_panel
+                )
+                prezzi = prezzi_portafoglio(panel_portafoglio)
+                nav = None
+                if len(prezzi) < 2:
+                    st.warning("Gli indici in portafoglio non hanno abbastanza date in comune")
+                else:
+                    try:
+                        nav, turnover = backtest_portafoglio(
+                            prezzi, pesi["Peso (%)"].fillna(0).to_numpy(), ribilanciamento, costo_bps, soglia
+                        )
+                    except ValueError as e:
+                        st.warning(str(e))
+                
+                if nav is not None:
+                    nome_portafoglio = "Portafoglio"
+                    statistiche_portafoglio = calcola_statistiche(
+                        {nome_portafoglio: serie_portafoglio(nav[0])}, [nome_portafoglio], oggi
+                    )
+                    st.dataframe(
+                        tabella_risultati(statistiche_portafoglio, [nome_portafoglio]),
+                        use_container_width=True,
+                        column_config=formato_tabella
+                    )
+                    
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Inizio Backtest", prezzi.index[0].strftime("%d/%m/%Y"))
+                    with col2:
+                        st.metric("Ribilanciamenti", int(turnover.at[0, "ribilanciamenti"]))
+                    with col3:
+                        st.metric("Turnover Totale", f"{turnover.at[0, 'turnover'] * 100:.1f}%")
+                    
+                    mostra_componenti = st.checkbox("Mostra gli indici in portafoglio (base 100)")
+                    curve = nav[[0]].set_axis([nome_portafoglio], axis=1)
+                    if mostra_componenti:
+                        curve = pd.concat([curve, ribasa_a_100(prezzi)], axis=1)
+                    serie_ridotte, usa_webgl = tracce_ridotte(
+                        curve, PUNTI_PER_TRACCIA, "lttb", SOGLIA_WEBGL,
+                        st.session_state.cache_tracce, panel_portafoglio,
+                        ("Portafoglio", tuple(pesi["Peso (%)"].fillna(0)), ribilanciamento, soglia, costo_bps, mostra_componenti)
+                    )
+                    fig = figura_linee(serie_ridotte, "Valore", "NAV del Portafoglio", "Valore (Base 100)", usa_webgl)
+                    st.plotly_chart(fig, use_container_width=True)
 
 # Gestione file caricati
 if st.session_state.dati_caricati:
@@ -468,16 +614,54 @@ if st.session_state.dati_caricati:
         with col2:
             if st.sidebar.button("🗑️", key=f"delete_{nome}", help="Elimina file"):
                 del st.session_state.dati_caricati[nome]
+                if archivio is not None:
+                    archivio.elimina(nome)
                 st.rerun()
     
     if st.sidebar.button("🗑️ Elimina Tutti"):
         st.session_state.dati_caricati = {}
         st.session_state.ultima_analisi = None
+        st.session_state.chiave_analisi = None
+        st.session_state.statistiche_indici = {}
+        st.session_state.cache_panel = OrderedDict()
+        st.session_state.cache_correlazioni = OrderedDict()
+        st.session_state.cache_tracce = OrderedDict()
+        if archivio is not None:
+            archivio.svuota()
         st.rerun()
 
 else:
     st.info("👆 Carica i tuoi file CSV dalla sidebar per iniziare l'analisi!")
 
+# Pannello diagnostica con le misure raccolte finora, compreso questo rerun
+if diagnostica.attiva:
+    st.sidebar.markdown("---")
+    st.sidebar.header("🩺 Diagnostica")
+    riepilogo = diagnostica.riepilogo()
+    if riepilogo:
+        st.sidebar.dataframe(
+            pd.DataFrame(riepilogo),
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                'ultimo_ms': st.column_config.NumberColumn("ultimo (ms)", format="%.1f"),
+                'medio_ms': st.column_config.NumberColumn("medio (ms)", format="%.1f"),
+                'max_ms': st.column_config.NumberColumn("max (ms)", format="%.1f"),
+                'picco_mb': st.column_config.NumberColumn("picco (MB)", format="%.2f")
+            }
+        )
+        st.sidebar.download_button(
+            "📥 Esporta JSON",
+            data=diagnostica.esporta_json(),
+            file_name=f"diagnostica_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json"
+        )
+        if st.sidebar.button("Azzera misure"):
+            diagnostica.svuota()
+            st.rerun()
+    else:
+        st.sidebar.caption("Nessuna misura ancora raccolta")
+
 # Footer
 st.markdown("---")
 st.markdown(
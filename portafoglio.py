@@ -0,0 +1,133 @@
+"""Backtest di portafogli composti dagli indici caricati
+
+Il NAV è calcolato sul panel dei prezzi allineati: fra due ribilanciamenti il valore di
+ogni combinazione di pesi è un prodotto matriciale dei prezzi relativi, così si possono
+valutare migliaia di combinazioni di pesi in un solo passaggio.
+"""
+import numpy as np
+import pandas as pd
+
+from analisi import rileva_periodi_per_anno
+
+# Frequenza di ribilanciamento (etichetta -> periodo pandas, None per buy & hold, 'soglia')
+RIBILANCIAMENTI = {
+    "Nessuno (buy & hold)": None,
+    "Mensile": "M",
+    "Trimestrale": "Q",
+    "Annuale": "Y",
+    "A soglia": "soglia"
+}
+# Scostamento massimo di un peso dal target (punti percentuali) prima di ribilanciare
+SOGLIA_RIBILANCIAMENTO = 5.0
+# Costo di transazione in punti base sul controvalore scambiato
+COSTO_TRANSAZIONE_BPS = 10.0
+NAV_INIZIALE = 100.0
+# Righe esaminate per volta nella ricerca del prossimo ribilanciamento a soglia
+BLOCCO_SOGLIA = 256
+
+def prezzi_portafoglio(panel):
+    """Restringe un panel as-of alle date da cui tutti gli indici hanno una quotazione"""
+    completi = panel.notna().all(axis=1).to_numpy()
+    if not completi.any():
+        return panel.iloc[:0]
+    return panel.iloc[int(completi.argmax()):]
+
+def normalizza_pesi(pesi):
+    """Porta i pesi (vettore o matrice combinazioni × indici) a somma 1 su ogni riga"""
+    pesi = np.atleast_2d(np.asarray(pesi, dtype=np.float64))
+    if (pesi < 0).any():
+        raise ValueError("I pesi non possono essere negativi")
+    totali = pesi.sum(axis=1, keepdims=True)
+    if (totali <= 0).any():
+        raise ValueError("La somma dei pesi deve essere positiva")
+    return pesi / totali
+
+def righe_ribilanciamento(date, frequenza):
+    """Righe in cui si ribilancia: la prima e la prima data di ogni nuovo mese, trimestre o anno"""
+    if frequenza is None or len(date) == 0:
+        return np.array([0], dtype=np.int64)
+    periodi = pd.DatetimeIndex(date).to_period(frequenza).asi8
+    return np.concatenate([[0], np.flatnonzero(periodi[1:] != periodi[:-1]) + 1])
+
+def righe_ribilanciamento_soglia(prezzi, pesi, soglia):
+    """Righe di ribilanciamento quando un peso si scosta dal target di più di soglia (frazione)
+
+    Dipende dal ribilanciamento precedente, quindi si procede un ribilanciamento alla volta;
+    a ogni passo i pesi correnti di un blocco di righe sono calcolati in modo vettoriale.
+    """
+    righe = [0]
+    inizio = 0
+    cerca_da = 1
+    while cerca_da < len(prezzi):
+        fine = min(cerca_da + BLOCCO_SOGLIA, len(prezzi))
+        relativi = prezzi[cerca_da:fine] / prezzi[inizio]
+        valori = relativi * pesi
+        pesi_correnti = valori / valori.sum(axis=1, keepdims=True)
+        oltre = (np.abs(pesi_correnti - pesi) > soglia).any(axis=1)
+        if oltre.any():
+            inizio = cerca_da + int(oltre.argmax())
+            righe.append(inizio)
+            cerca_da = inizio + 1
+        else:
+            cerca_da = fine
+    return np.array(righe, dtype=np.int64)
+
+def nav_portafoglio(prezzi, pesi, righe, costo=0.0):
+    """NAV di una o più combinazioni di pesi con ribilanciamento alle righe indicate
+
+    prezzi è la matrice date × indici, pesi la matrice combinazioni × indici (somma 1), costo
+    la frazione pagata sul controvalore scambiato (acquisto iniziale compreso). Restituisce
+    il NAV (date × combinazioni) e il turnover di ogni ribilanciamento (ribilanciamenti × combinazioni).
+    """
+    segmento = np.searchsorted(righe, np.arange(len(prezzi)), side='right') - 1
+    # Crescita di ogni combinazione dall'ultimo ribilanciamento
+    crescita = (prezzi / prezzi[righe[segmento]]) @ pesi.T
+
+    # Al ribilanciamento i pesi, cambiati con i prezzi, tornano al target pagando il turnover
+    relativi_fine = prezzi[righe[1:]] / prezzi[righe[:-1]]
+    crescita_fine = relativi_fine @ pesi.T
+    pesi_fine = relativi_fine[:, None, :] * pesi[None, :, :] / crescita_fine[:, :, None]
+    turnover = np.concatenate([
+        np.ones((1, len(pesi))),
+        np.abs(pesi_fine - pesi[None, :, :]).sum(axis=2)
+    ])
+    fattori = np.concatenate([np.ones((1, len(pesi))), crescita_fine]) * (1 - costo * turnover)
+    nav_inizio = NAV_INIZIALE * np.cumprod(fattori, axis=0)
+    return nav_inizio[segmento] * crescita, turnover
+
+def backtest_portafoglio(panel, pesi, ribilanciamento=None, costo_bps=COSTO_TRANSAZIONE_BPS,
+                         soglia=SOGLIA_RIBILANCIAMENTO):
+    """Esegue il backtest sul panel dei prezzi per una o più combinazioni di pesi
+
+    ribilanciamento è un valore di RIBILANCIAMENTI; la soglia è in punti percentuali. Con il
+    ribilanciamento a soglia le date dipendono dai pesi, quindi le combinazioni sono simulate
+    una alla volta. Restituisce il NAV (DataFrame date × combinazioni) e il turnover per
+    combinazione (numero di ribilanciamenti e turnover totale).
+    """
+    pesi = normalizza_pesi(pesi)
+    prezzi = panel.to_numpy(dtype=np.float64)
+    costo = costo_bps / 10_000
+
+    if ribilanciamento == "soglia":
+        nav = np.empty((len(prezzi), len(pesi)))
+        riepilogo = []
+        for c, pesi_combinazione in enumerate(pesi):
+            righe = righe_ribilanciamento_soglia(prezzi, pesi_combinazione, soglia / 100)
+            nav_combinazione, turnover = nav_portafoglio(prezzi, pesi_combinazione[None, :], righe, costo)
+            nav[:, c] = nav_combinazione[:, 0]
+            riepilogo.append((len(righe) - 1, turnover[1:, 0].sum()))
+    else:
+        righe = righe_ribilanciamento(panel.index, ribilanciamento)
+        nav, turnover = nav_portafoglio(prezzi, pesi, righe, costo)
+        riepilogo = list(zip([len(righe) - 1] * len(pesi), turnover[1:].sum(axis=0)))
+
+    return (
+        pd.DataFrame(nav, index=panel.index),
+        pd.DataFrame(riepilogo, columns=["ribilanciamenti", "turnover"])
+    )
+
+def serie_portafoglio(nav):
+    """Converte una colonna di NAV nel formato Date/Price degli indici caricati"""
+    df = pd.DataFrame({'Date': nav.index, 'Price': nav.to_numpy(dtype=np.float64)})
+    df.attrs['periodi_anno'] = rileva_periodi_per_anno(df['Date'])
+    return df
@@ -0,0 +1,79 @@
+"""Regressione di calcola_drawdown_indici rispetto a un ciclo riga per riga
+
+Picco, minimo e recupero del calcolo vettoriale devono coincidere con quelli di una
+scansione sequenziale di ogni serie, anche con serie di lunghezze diverse nello stesso blocco.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analisi  # noqa: E402
+
+
+def drawdown_riga_per_riga(df):
+    """Massimo drawdown (%), durata e recupero (giorni) e drawdown attuale (%) di una serie"""
+    prezzi = df['Price'].to_numpy(dtype=np.float64)
+    date = df['Date']
+    peggiore, picco_peggiore, minimo = 0.0, 0, 0
+    picco = 0
+    for i in range(len(prezzi)):
+        if prezzi[i] >= prezzi[picco]:
+            picco = i
+        drawdown = prezzi[i] / prezzi[picco] - 1
+        if drawdown < peggiore:
+            peggiore, picco_peggiore, minimo = drawdown, picco, i
+    
+    recupero = 0.0 if peggiore == 0 else np.nan
+    if peggiore < 0:
+        for i in range(minimo + 1, len(prezzi)):
+            if prezzi[i] >= prezzi[picco_peggiore]:
+                recupero = (date.iloc[i] - date.iloc[minimo]) / pd.Timedelta(days=1)
+                break
+    return [
+        peggiore * 100,
+        (date.iloc[minimo] - date.iloc[picco_peggiore]) / pd.Timedelta(days=1),
+        recupero,
+        (prezzi[-1] / prezzi.max() - 1) * 100,
+    ]
+
+
+def serie_casuali(rng, numero):
+    dati = {}
+    for j in range(numero):
+        righe = int(rng.integers(2, 400))
+        prezzi = 100 * np.exp(np.cumsum(rng.normal(0.001, 0.02, righe)))
+        frequenza = ['D', 'B', 'MS', '5min'][j % 4]
+        dati[f"Indice {j}"] = pd.DataFrame({
+            'Date': pd.date_range('2000-01-01', periods=righe, freq=frequenza), 'Price': prezzi
+        })
+    # Casi limite: sempre crescente, drawdown recuperato, ancora in drawdown, prezzi ripetuti
+    casi = {
+        'crescente': np.arange(1.0, 11.0),
+        'recuperato': np.array([5.0, 4.0, 5.0, 4.0, 6.0]),
+        'non recuperato': np.array([10.0, 12.0, 6.0, 8.0]),
+        'costante': np.full(6, 3.0),
+    }
+    for nome, prezzi in casi.items():
+        dati[nome] = pd.DataFrame({'Date': pd.date_range('2010-01-01', periods=len(prezzi)), 'Price': prezzi})
+    return dati
+
+
+def verifica(dati):
+    risultati = analisi.calcola_drawdown_indici(dati, list(dati))
+    for nome, df in dati.items():
+        np.testing.assert_allclose(
+            risultati.loc[nome].to_numpy(), drawdown_riga_per_riga(df), rtol=1e-12, atol=1e-9, err_msg=nome
+        )
+
+
+def test_drawdown_come_ciclo_riga_per_riga():
+    verifica(serie_casuali(np.random.default_rng(3), 60))
+
+
+def test_drawdown_con_blocchi_piccoli(monkeypatch):
+    # Con poche celle per blocco le serie sono divise in molti blocchi di lunghezze diverse
+    monkeypatch.setattr(analisi, 'CELLE_PER_BLOCCO_DRAWDOWN', 1500)
+    verifica(serie_casuali(np.random.default_rng(4), 60))
@@ -0,0 +1,86 @@
+"""Regressione del backtest vettoriale rispetto a una simulazione giorno per giorno
+
+NAV, numero di ribilanciamenti e turnover di backtest_portafoglio devono coincidere con
+quelli di un portafoglio simulato detenendo le quote e ribilanciando una data alla volta.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import portafoglio  # noqa: E402
+
+COSTO_BPS = 25.0
+SOGLIA = 3.0
+
+
+def panel_casuale(seme, righe=800, indici=4):
+    rng = np.random.default_rng(seme)
+    prezzi = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.012, (righe, indici)), axis=0))
+    return pd.DataFrame(prezzi, index=pd.bdate_range('2015-01-01', periods=righe))
+
+
+def backtest_giorno_per_giorno(panel, pesi, ribilanciamento, costo, soglia):
+    """NAV, ribilanciamenti e turnover tenendo le quote e ribilanciando una data alla volta"""
+    prezzi = panel.to_numpy()
+    pesi = np.asarray(pesi) / np.sum(pesi)
+    # L'acquisto iniziale paga il costo su tutto il controvalore
+    quote = portafoglio.NAV_INIZIALE * (1 - costo) * pesi / prezzi[0]
+    periodi = None
+    if ribilanciamento not in (None, "soglia"):
+        periodi = panel.index.to_period(ribilanciamento)
+    nav, ribilanciamenti, turnover = [], 0, 0.0
+    for t in range(len(prezzi)):
+        valore = (quote * prezzi[t]).sum()
+        pesi_correnti = quote * prezzi[t] / valore
+        if ribilanciamento == "soglia":
+            ribilancia = t > 0 and (np.abs(pesi_correnti - pesi) > soglia).any()
+        else:
+            ribilancia = periodi is not None and t > 0 and periodi[t] != periodi[t - 1]
+        if ribilancia:
+            scambiato = np.abs(pesi - pesi_correnti).sum()
+            valore *= 1 - costo * scambiato
+            quote = valore * pesi / prezzi[t]
+            ribilanciamenti += 1
+            turnover += scambiato
+        nav.append(valore)
+    return np.array(nav), ribilanciamenti, turnover
+
+
+@pytest.mark.parametrize("ribilanciamento", list(portafoglio.RIBILANCIAMENTI.values()))
+def test_backtest_come_simulazione_giorno_per_giorno(ribilanciamento):
+    panel = panel_casuale(11)
+    pesi = [0.4, 0.3, 0.2, 0.1]
+    nav, riepilogo = portafoglio.backtest_portafoglio(panel, pesi, ribilanciamento, COSTO_BPS, SOGLIA)
+    atteso, ribilanciamenti, turnover = backtest_giorno_per_giorno(
+        panel, pesi, ribilanciamento, COSTO_BPS / 10_000, SOGLIA / 100
+    )
+    np.testing.assert_allclose(nav[0].to_numpy(), atteso, rtol=1e-12)
+    assert riepilogo.at[0, "ribilanciamenti"] == ribilanciamenti
+    assert riepilogo.at[0, "turnover"] == pytest.approx(turnover, rel=1e-12)
+
+
+@pytest.mark.parametrize("ribilanciamento", ["M", "soglia"])
+def test_combinazioni_di_pesi_indipendenti(ribilanciamento):
+    # Più combinazioni nello stesso backtest danno gli stessi NAV dei backtest separati
+    panel = panel_casuale(12)
+    pesi = np.random.default_rng(5).dirichlet(np.ones(panel.shape[1]), size=6)
+    nav, riepilogo = portafoglio.backtest_portafoglio(panel, pesi, ribilanciamento, COSTO_BPS, SOGLIA)
+    for c, pesi_combinazione in enumerate(pesi):
+        atteso, ribilanciamenti, turnover = backtest_giorno_per_giorno(
+            panel, pesi_combinazione, ribilanciamento, COSTO_BPS / 10_000, SOGLIA / 100
+        )
+        np.testing.assert_allclose(nav[c].to_numpy(), atteso, rtol=1e-12)
+        assert riepilogo.at[c, "ribilanciamenti"] == ribilanciamenti
+        assert riepilogo.at[c, "turnover"] == pytest.approx(turnover, rel=1e-12)
+
+
+def test_pesi_non_validi():
+    panel = panel_casuale(13, righe=10, indici=2)
+    with pytest.raises(ValueError):
+        portafoglio.backtest_portafoglio(panel, [1.0, -1.0])
+    with pytest.raises(ValueError):
+        portafoglio.backtest_portafoglio(panel, [0.0, 0.0])
@@ -0,0 +1,68 @@
+"""Regressione della ricerca dell'inizio dei dati con RE_INIZIO_DATI
+
+Gli offset devono coincidere con quelli dello scanner riga per riga che l'espressione
+regolare ha sostituito, su intestazioni casuali e a cavallo dei blocchi di lettura.
+"""
+import os
+import random
+import sys
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analisi  # noqa: E402
+
+PEZZI = [
+    '=== INFO ===', 'Nome,X', 'Ticker,AB', 'Data Download,2020-01-01', ' Nome,1/2', '', '   ',
+    'Date,Price', 'abc,def', '12/2020,100', ' 2020-01-01 ,5', '123,4', ' 123 ,4', '12a,3', 'foo',
+    'x=== DATI STORICI ===y', '=== DATI STORICI ===', 'Prezzo,3', '-,1', ',5', ' ,5', '1 2,3',
+    '\t7\t,1', '2020-01-01', 'a/b', '=== DATI STORICI ===,1/1'
+]
+
+
+def sembra_riga_dati(riga):
+    """Regole dello scanner originale: non metadata, con un primo campo simile a una data"""
+    if not riga.strip() or riga.startswith(analisi.PREFISSI_METADATA) or ',' not in riga:
+        return False
+    primo = riga.split(',')[0].strip()
+    return bool(primo) and (primo.replace('-', '').replace('/', '').isdigit() or '/' in primo or '-' in primo)
+
+
+def inizio_dati_riga_per_riga(contenuto):
+    file = BytesIO(contenuto)
+    while True:
+        offset = file.tell()
+        riga = file.readline()
+        if not riga:
+            return -1
+        riga = riga.decode('utf-8')
+        if analisi.MARKER_DATI_STORICI in riga:
+            return file.tell()
+        if sembra_riga_dati(riga):
+            return offset
+
+
+def test_intestazioni_casuali():
+    rng = random.Random(1)
+    for _ in range(20_000):
+        separatore = rng.choice(['\n', '\r\n'])
+        testo = separatore.join(rng.choices(PEZZI, k=rng.randint(0, 8))) + rng.choice(['', separatore])
+        contenuto = testo.encode()
+        assert analisi.trova_inizio_dati(BytesIO(contenuto)) == inizio_dati_riga_per_riga(contenuto), repr(testo)
+
+
+def test_intestazioni_lunghe_a_cavallo_dei_blocchi():
+    blocco = analisi.BLOCCO_INTESTAZIONE
+    for lunghezza in [blocco - 6, blocco, blocco + 4, 3 * blocco, 5 * blocco + 1]:
+        for coda in ['=== DATI STORICI ===\n01/2020,1\n', '01/2020,1\n', '=== DATI STORICI ===', 'nessun dato\n']:
+            contenuto = (
+                ('Nome,' + 'x' * 50 + '\n') * (lunghezza // 56) + 'y' * (lunghezza % 56) + '\n' + coda
+            ).encode()
+            assert analisi.trova_inizio_dati(BytesIO(contenuto)) == inizio_dati_riga_per_riga(contenuto)
+
+
+def test_lettura_limitata_senza_dati_riconoscibili():
+    contenuto = ''.join(f"riga{i},{i}\n" for i in range(200_000)).encode()
+    assert len(contenuto) > analisi.MAX_BYTES_INTESTAZIONE
+    file = BytesIO(contenuto)
+    assert analisi.trova_inizio_dati(file) == -1
+    assert file.tell() <= analisi.MAX_BYTES_INTESTAZIONE